@@ -0,0 +1,76 @@
+# adapt.py
+
+"""
+This module contains the controller that adapts the frame rate and width the camera sends at to how
+quickly the server acknowledges and processes the frames
+"""
+
+import time
+
+# widths the frames are scaled down to, largest first. The server works on
+# 400 pixel wide frames, so going below that trades detection accuracy for
+# bandwidth
+WIDTHS = [640, 480, 400, 320, 240]
+
+
+class RateController:
+    """
+    Keeps the smoothed acknowledgement round-trip time under a target and the server from overwriting
+    frames it could not process in time. Once per adjustment period the frame rate is cut by a factor
+    while the round trip is too slow or frames were overwritten, and raised by a step while the round
+    trip is well under the target. The width only goes down once the rate is at its minimum, and back
+    up once the rate is at its maximum, as the rate is the cheaper thing to give up.
+    """
+
+    def __init__(self, target, min_fps=1.0, max_fps=30.0, widths=WIDTHS, period=1.0, smoothing=0.2,
+                 decrease=0.7, increase=1.0, headroom=0.5):
+        self.target = target
+        self.min_fps = min_fps
+        self.max_fps = max_fps
+        self.widths = widths
+        self.period = period
+        self.smoothing = smoothing
+        self.decrease = decrease
+        self.increase = increase
+        self.headroom = headroom
+        self.fps = max_fps
+        self.level = 0
+        self.rtt = None
+        self.congested = False
+        self.lastChange = time.monotonic()
+
+    @property
+    def width(self):
+        return self.widths[self.level]
+
+    def update(self, rtt=None, overwritten=0):
+        """
+        Function records the round trip of a frame and adjusts the rate and width once per period
+        :param rtt: Seconds the server took to acknowledge the frame, None if the frame was dropped
+        :param overwritten: Frames of the camera the server overwrote before processing them since the
+            last update
+        """
+        if rtt is None:
+            # a frame dropped on the camera means the link is full
+            self.congested = True
+        else:
+            self.rtt = rtt if self.rtt is None else self.rtt + self.smoothing * (rtt - self.rtt)
+        if overwritten:
+            # a frame overwritten on the server means inference cannot keep
+            # up, however quickly the frames are acknowledged
+            self.congested = True
+        now = time.monotonic()
+        if now - self.lastChange < self.period:
+            return
+        self.lastChange = now
+        if self.congested or (self.rtt is not None and self.rtt > self.target):
+            if self.fps > self.min_fps:
+                self.fps = max(self.min_fps, self.fps * self.decrease)
+            elif self.level < len(self.widths) - 1:
+                self.level += 1
+        elif self.rtt is not None and self.rtt < self.target * self.headroom:
+            if self.fps < self.max_fps:
+                self.fps = min(self.max_fps, self.fps + self.increase)
+            elif self.level > 0:
+                self.level -= 1
+        self.congested = False
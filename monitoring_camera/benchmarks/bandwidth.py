@@ -0,0 +1,131 @@
+# benchmarks/bandwidth.py
+
+"""
+Replays recorded footage through the motion filter of the client and reports the uplink bandwidth per
+hour of sending every frame against sending only the frames of a moving scene, with keyframes and
+heartbeats while it is static.
+
+Run from the monitoring_camera directory:
+    python -m benchmarks.bandwidth -f recording.mp4 -m 0.005 0.01 0.02 -q 70
+"""
+
+import argparse
+import json
+
+import numpy as np
+import cv2
+
+from motion import MotionFilter, SEND, HEARTBEAT
+
+
+def synthetic_footage(seconds, fps, width=640, height=480, seed=0):
+    """
+    Function generates footage of a room that stays empty most of the time: a figure walks across for
+    eight seconds of every minute, on top of sensor noise
+    :param seconds: Duration of the footage
+    :param fps: Frames per second
+    :param width: Frame width
+    :param height: Frame height
+    :param seed: Seed of the random generator so runs are comparable
+    :return: Generator of uint8 BGR frames
+    """
+    rng = np.random.default_rng(seed)
+    (ys, xs) = np.mgrid[0:height, 0:width]
+    background = np.dstack([(xs * 120 // width + 60), (ys * 100 // height + 80), np.full_like(xs, 110)]).astype(np.uint8)
+    cv2.rectangle(background, (40, height // 2), (width // 3, height - 40), (40, 70, 120), -1)
+    cv2.rectangle(background, (width // 2, 60), (width - 60, height // 3), (150, 150, 160), -1)
+    for i in range(int(seconds * fps)):
+        frame = background.copy()
+        t = (i / fps) % 60
+        if t < 8:
+            cv2.ellipse(frame, (int(t / 8 * width), height // 2), (40, 110), 0, 0, 360, (30, 30, 200), -1)
+        noise = rng.integers(-6, 7, frame.shape, dtype=np.int16)
+        yield np.clip(frame.astype(np.int16) + noise, 0, 255).astype(np.uint8)
+
+
+def video_footage(path):
+    """
+    Function reads the frames of a recorded video
+    :param path: Path of the video file
+    :return: Tuple of the frame rate of the video and a generator of its BGR frames
+    """
+    stream = cv2.VideoCapture(path)
+    fps = stream.get(cv2.CAP_PROP_FPS) or 30.0
+
+    def frames():
+        while True:
+            (grabbed, frame) = stream.read()
+            if not grabbed:
+                break
+            yield frame
+        stream.release()
+
+    return fps, frames()
+
+
+def replay(frames, fps, thresholds, quality, keyframe, heartbeat):
+    """
+    Function sizes the messages the client would send for every frame of the footage
+    :param frames: Frames of the footage
+    :param fps: Frames per second of the footage
+    :param thresholds: Motion thresholds to filter the footage with
+    :param quality: JPEG quality the frames are sent with, 0 for raw frames
+    :param keyframe: Seconds between the keyframes of a static scene
+    :param heartbeat: Seconds between the heartbeats of a static scene
+    :return: Tuple of the duration in seconds, the bytes of sending every frame and, per threshold, a
+        dictionary of the bytes, frames and heartbeats sent
+    """
+    filters = {threshold: MotionFilter(threshold, keyframe, heartbeat) for threshold in thresholds}
+    sent = {threshold: {"bytes": 0, "frames": 0, "heartbeats": 0} for threshold in thresholds}
+    beat = len(json.dumps({"msg": "camera", "heartbeat": True}))
+    (count, total) = (0, 0)
+    for frame in frames:
+        if quality:
+            size = len(cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, quality])[1])
+        else:
+            size = frame.nbytes
+        # the metadata of a frame is the same size as that of a heartbeat
+        size += beat
+        total += size
+        for (threshold, motion) in filters.items():
+            action = motion.decide(frame, count / fps)
+            if action == SEND:
+                sent[threshold]["bytes"] += size
+                sent[threshold]["frames"] += 1
+            elif action == HEARTBEAT:
+                sent[threshold]["bytes"] += beat
+                sent[threshold]["heartbeats"] += 1
+        count += 1
+    return count / fps, total, sent
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("-f", "--video-file", nargs="*", default=[], help="recorded clips, synthetic footage when missing")
+    ap.add_argument("-m", "--motion-threshold", type=float, nargs="+", default=[0.005, 0.01, 0.02],
+                    help="motion thresholds to compare")
+    ap.add_argument("-q", "--jpeg-quality", type=int, default=70, help="JPEG quality the frames are sent with, 0 for raw")
+    ap.add_argument("--keyframe-interval", type=float, default=10, help="seconds between the keyframes of a static scene")
+    ap.add_argument("--heartbeat-interval", type=float, default=0.5,
+                    help="seconds between the heartbeats of a static scene")
+    ap.add_argument("--seconds", type=float, default=300, help="duration of the synthetic footage")
+    ap.add_argument("--fps", type=float, default=10, help="frames per second of the synthetic footage")
+    args = vars(ap.parse_args())
+
+    clips = [(path,) + video_footage(path) for path in args["video_file"]]
+    clips = clips or [("synthetic", args["fps"], synthetic_footage(args["seconds"], args["fps"]))]
+    print("{:>20} {:>9} {:>8} {:>10} {:>12} {:>12} {:>7}".format(
+        "footage", "threshold", "frames", "heartbeats", "every MB/h", "gated MB/h", "saved"))
+    for (name, fps, frames) in clips:
+        (seconds, total, sent) = replay(frames, fps, args["motion_threshold"], args["jpeg_quality"],
+                                        args["keyframe_interval"], args["heartbeat_interval"])
+        for (threshold, gated) in sent.items():
+            # bytes per hour of footage, in megabytes
+            (every, filtered) = (total / seconds * 3600 / 1e6, gated["bytes"] / seconds * 3600 / 1e6)
+            print("{:>20} {:>9} {:>8} {:>10} {:>12.1f} {:>12.1f} {:>6.1f}%".format(
+                name[-20:], threshold, gated["frames"], gated["heartbeats"], every, filtered,
+                (1 - filtered / every) * 100))
+
+
+if __name__ == "__main__":
+    main()
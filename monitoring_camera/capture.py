@@ -0,0 +1,106 @@
+# capture.py
+
+"""
+This module contains the capture thread that reads the camera at its own rate and the slot it hands the
+latest frame to the sender through
+"""
+
+import os
+import threading
+import time
+
+import cv2
+
+
+def video_length(path):
+    """
+    Function returns the number of frames of a video file
+    :param path: Path of the video file
+    :return: Frame count, 0 if it is unknown
+    """
+    stream = cv2.VideoCapture(path)
+    length = int(stream.get(cv2.CAP_PROP_FRAME_COUNT))
+    stream.release()
+    return max(length, 0)
+
+
+class FrameSlot:
+    """
+    Holds the latest captured frame until the sender takes it. A new frame overwrites one the sender has
+    not taken yet, so a slow network drops stale frames instead of holding up the capture.
+    """
+
+    def __init__(self):
+        self.ready = threading.Condition()
+        self.frame = None
+        self.stamp = None
+        self.captured = 0
+        self.dropped = 0
+
+    def put(self, frame):
+        """
+        Function stores the latest frame with the time it was captured, replacing any frame not yet taken
+        :param frame: Captured BGR frame
+        """
+        stamp = time.time()
+        with self.ready:
+            if self.frame is not None:
+                self.dropped += 1
+            self.frame = frame
+            self.stamp = stamp
+            self.captured += 1
+            self.ready.notify_all()
+
+    def take(self, timeout=None):
+        """
+        Function waits for a frame newer than the last one taken and removes it
+        :param timeout: Maximum seconds to wait, None to wait forever
+        :return: Tuple of the BGR frame and the time it was captured, (None, None) if no frame was
+            captured in time
+        """
+        with self.ready:
+            self.ready.wait_for(lambda: self.frame is not None, timeout)
+            (frame, self.frame) = (self.frame, None)
+            return frame, self.stamp
+
+
+class CameraCapture(threading.Thread):
+    """
+    Reads frames from a camera as fast as the camera delivers them, or from a video file at its own
+    frame rate or a fixed one, and puts them in a slot. The thread ends when the source stops
+    delivering frames, unless a video file is looped.
+    """
+
+    def __init__(self, src, slot, fps=0, loop=False, start=0):
+        super().__init__(daemon=True)
+        self.src = src
+        self.slot = slot
+        self.loop = loop
+        self.stream = cv2.VideoCapture(src)
+        # cameras deliver frames at their own rate, files are paced to the
+        # rate they were recorded at unless one is given
+        self.replay = isinstance(src, str) and os.path.isfile(src)
+        self.fps = fps or ((self.stream.get(cv2.CAP_PROP_FPS) or 30.0) if self.replay else 0)
+        if start:
+            self.stream.set(cv2.CAP_PROP_POS_FRAMES, start)
+
+    def run(self):
+        due = time.monotonic()
+        while True:
+            (grabbed, frame) = self.stream.read()
+            if not grabbed and self.replay and self.loop:
+                self.stream.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                (grabbed, frame) = self.stream.read()
+            if not grabbed:
+                break
+            if self.fps:
+                # keep to the schedule of the frame rate, starting over when
+                # decoding fell more than a frame behind
+                due += 1.0 / self.fps
+                now = time.monotonic()
+                if due > now:
+                    time.sleep(due - now)
+                elif now - due > 1.0 / self.fps:
+                    due = now
+            self.slot.put(frame)
+        self.stream.release()
@@ -1,30 +1,125 @@
-from imutils.video import VideoStream
-import imagezmq
 import argparse
 import socket
-import time
+
+from capture import FrameSlot, CameraCapture, video_length
+from sender import FrameSender
+from transport import Uplink
+from adapt import RateController
+from motion import MotionFilter
 
 # construct the argument parser and parse the arguments
 ap = argparse.ArgumentParser()
 ap.add_argument("-s", "--server-ip", required=True,help="ip address of the server to which the client will connect")
-ap.add_argument("-f", "--video-file", required=False,help="ip address of the server to which the client will connect")
+ap.add_argument("-c", "--cameras", nargs="+", default=["0"],
+                help="indices or device paths of the cameras to read, each sent as its own stream named after "
+                     "the host and the camera, host/cam0, host/cam1, ... over one connection")
+ap.add_argument("-f", "--video-file", required=False, help="video file to replay instead of reading the camera")
+ap.add_argument("--replay-fps", type=float, default=0,
+                help="frames per second to replay the video file at, 0 for the rate it was recorded at")
+ap.add_argument("--loop", action="store_true", help="replay the video file from the start once it ends")
+ap.add_argument("-n", "--simulate", type=int, default=0,
+                help="number of virtual cameras replaying the video file, each with its own name and connection")
+ap.add_argument("-q", "--jpeg-quality", type=int, default=0,
+                help="JPEG quality (1-100) to compress frames with before sending, 0 to send raw frames")
+ap.add_argument("-t", "--transport", choices=["reqrep", "pushpull"], default="reqrep",
+                help="reqrep to wait for the server to acknowledge every frame, pushpull to send without waiting")
+ap.add_argument("--hwm", type=int, default=2, help="frames queued in pushpull mode before new frames are dropped")
+ap.add_argument("-l", "--target-latency", type=float, default=0,
+                help="acknowledgement round trip in milliseconds to adapt the frame rate and width to, 0 to send "
+                     "every frame at full size")
+ap.add_argument("--min-fps", type=float, default=1, help="lowest frame rate the adaptation may go down to")
+ap.add_argument("--max-fps", type=float, default=30, help="highest frame rate the adaptation may go up to")
+ap.add_argument("--ack-timeout", type=float, default=5,
+                help="seconds to wait for the server to acknowledge a frame before reconnecting")
+ap.add_argument("--max-backoff", type=float, default=30,
+                help="longest wait in seconds between attempts to reconnect to the server")
+ap.add_argument("--stats-interval", type=float, default=30,
+                help="seconds between the frame counters logged, 0 to log none")
+ap.add_argument("-m", "--motion-threshold", type=float, default=0,
+                help="fraction of a downscaled grayscale copy of the frame that has to change for frames to be "
+                     "sent, 0 to send every frame")
+ap.add_argument("--keyframe-interval", type=float, default=10,
+                help="seconds between the frames sent while the scene is static")
+ap.add_argument("--heartbeat-interval", type=float, default=0.5,
+                help="seconds between the heartbeats sent instead of the frames of a static scene")
 
 args = vars(ap.parse_args())
-# initialize the ImageSender object with the socket address of the
-# server
-sender = imagezmq.ImageSender(connect_to="tcp://{}:5555".format(args["server_ip"]))
-# get the host name, initialize the video stream, and allow the
-# camera sensor to warmup
-clientName = socket.gethostname()
+if args["simulate"] and not args["video_file"]:
+    ap.error("--simulate replays a video file, give one with --video-file")
+
+
+def open_uplink():
+    # a connection to the server, reopened whenever sending fails
+    return Uplink(args["server_ip"], args["transport"], hwm=args["hwm"], timeout=args["ack_timeout"],
+                  max_backoff=args["max_backoff"])
+
 
-vs = VideoStream(src=0).start()
+def open_camera(name, src, uplink, start=0):
+    """
+    Function starts reading a source on its own thread, so that the capture never waits on the network,
+    and sending its latest frame on another
+    :param name: Name the frames are sent under
+    :param src: Index of the camera, or path of a camera device or a video file
+    :param uplink: Connection to send the frames through, possibly shared with other cameras
+    :param start: Frame of the video file to start the replay at
+    :return: Tuple of the capture and sender threads
+    """
+    slot = FrameSlot()
+    capture = CameraCapture(src, slot, fps=args["replay_fps"], loop=args["loop"], start=start)
+    # adapt the frame rate and width to how quickly the server acknowledges
+    # the frames when a target latency is given
+    controller = None
+    if args["target_latency"]:
+        controller = RateController(args["target_latency"] / 1000.0, args["min_fps"], args["max_fps"])
+    # only send the frames of a moving scene when a motion threshold is given,
+    # and a keyframe and heartbeats while it is static
+    motion = None
+    if args["motion_threshold"]:
+        motion = MotionFilter(args["motion_threshold"], args["keyframe_interval"], args["heartbeat_interval"])
+    sender = FrameSender(name, slot, uplink, args["jpeg_quality"], controller, motion)
+    capture.start()
+    sender.start()
+    return capture, sender
 
-time.sleep(2.0)
 
-while True:
-    # read the frame from the camera and send it to the server
-    frame = vs.read()
-    try:
-        sender.send_image(clientName, frame)
-    except:
-        break
+def log_counters(cameras):
+    # frame counters summed over every camera of the process, counting a
+    # connection shared by several cameras once
+    uplinks = list({id(sender.uplink): sender.uplink for (capture, sender) in cameras}.values())
+    print("[INFO] {} camera(s): captured {}, sent {}, dropped {}, skipped {}, reconnects {}".format(
+        len(cameras), sum(capture.slot.captured for (capture, sender) in cameras),
+        sum(uplink.sent for uplink in uplinks),
+        sum(capture.slot.dropped for (capture, sender) in cameras) + sum(uplink.dropped for uplink in uplinks),
+        sum(sender.skipped for (capture, sender) in cameras), sum(uplink.reconnects for uplink in uplinks)))
+
+
+# get the host name, and read the cameras, or the video file when one is
+# given. Virtual cameras are named after the host and start their replay
+# spread over the file so that they do not all send the same frame, each
+# with a connection of its own as separate devices would have. The
+# cameras of this host share a single connection, a single camera being
+# named after the host alone
+clientName = socket.gethostname()
+if args["simulate"]:
+    length = video_length(args["video_file"])
+    cameras = [open_camera("{}/sim{}".format(clientName, i), args["video_file"], open_uplink(),
+                           i * length // args["simulate"])
+               for i in range(args["simulate"])]
+elif args["video_file"]:
+    cameras = [open_camera(clientName, args["video_file"], open_uplink())]
+else:
+    uplink = open_uplink()
+    sources = [int(src) if src.isdigit() else src for src in args["cameras"]]
+    names = [clientName] if len(sources) == 1 else ["{}/cam{}".format(clientName, i) for i in range(len(sources))]
+    cameras = [open_camera(name, src, uplink) for (name, src) in zip(names, sources)]
+
+# log the frame counters until every source stops delivering frames
+try:
+    for (capture, sender) in cameras:
+        while capture.is_alive():
+            capture.join(args["stats_interval"] or None)
+            if args["stats_interval"]:
+                log_counters(cameras)
+except KeyboardInterrupt:
+    pass
+log_counters(cameras)
@@ -0,0 +1,75 @@
+# motion.py
+
+"""
+This module contains the motion filter that stops the camera sending frames of a static scene
+"""
+
+import time
+
+import numpy as np
+import imutils
+import cv2
+
+# width the frames are downscaled to before looking for motion, and the
+# grey level change a pixel needs to count as changed
+FILTER_WIDTH = 160
+PIXEL_THRESHOLD = 25
+# what the filter decides to do with a frame
+SEND = "frame"
+HEARTBEAT = "heartbeat"
+SKIP = None
+
+
+class MotionFilter:
+    """
+    Decides whether a frame differs enough from the last frame sent to be worth sending. Once motion is
+    seen every frame is sent for a while; while the scene stays static only a keyframe is sent every so
+    often, so the server keeps a current picture, and a heartbeat in between so it knows the camera is
+    still there.
+    """
+
+    def __init__(self, threshold=0.01, keyframe=10.0, heartbeat=0.5, hold=2.0):
+        self.threshold = threshold
+        self.keyframe = keyframe
+        self.heartbeat = heartbeat
+        self.hold = hold
+        self.reference = None
+        self.lastMotion = None
+        self.lastSent = None
+        self.lastBeat = None
+
+    def changed(self, frame):
+        """
+        Function measures the fraction of pixels that changed in a downscaled grayscale copy of the frame
+        :param frame: BGR frame
+        :return: Tuple of the fraction of changed pixels between 0 and 1 and the downscaled copy
+        """
+        gray = cv2.cvtColor(imutils.resize(frame, width=FILTER_WIDTH, inter=cv2.INTER_AREA), cv2.COLOR_BGR2GRAY)
+        small = cv2.GaussianBlur(gray, (5, 5), 0)
+        if self.reference is None or self.reference.shape != small.shape:
+            return 1.0, small
+        # compare against the frame last sent so that slow movements add up
+        # instead of vanishing between consecutive frames
+        diff = cv2.absdiff(self.reference, small)
+        return np.count_nonzero(diff > PIXEL_THRESHOLD) / diff.size, small
+
+    def decide(self, frame, now=None):
+        """
+        Function decides what to send for a frame
+        :param frame: BGR frame
+        :param now: Time of the frame in seconds, the monotonic clock if omitted
+        :return: SEND to send the frame, HEARTBEAT to send a heartbeat instead, SKIP to send nothing
+        """
+        now = time.monotonic() if now is None else now
+        (fraction, small) = self.changed(frame)
+        if fraction > self.threshold:
+            self.lastMotion = now
+        moving = self.lastMotion is not None and now - self.lastMotion < self.hold
+        if moving or self.lastSent is None or now - self.lastSent >= self.keyframe:
+            self.reference = small
+            self.lastSent = self.lastBeat = now
+            return SEND
+        if now - self.lastBeat >= self.heartbeat:
+            self.lastBeat = now
+            return HEARTBEAT
+        return SKIP
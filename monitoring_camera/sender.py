@@ -0,0 +1,67 @@
+# sender.py
+
+"""
+This module contains the sender thread that sends the latest frame of a camera to the server, filtered
+by motion and paced to the network when enabled
+"""
+
+import threading
+import time
+
+import imutils
+import cv2
+
+from motion import SEND, HEARTBEAT
+
+
+class FrameSender(threading.Thread):
+    """
+    Takes the latest frame of a camera from its slot whenever the previous send is done and sends it
+    through an uplink, so that a slow network drops frames instead of slowing the capture down
+    """
+
+    def __init__(self, name, slot, uplink, quality=0, controller=None, motion=None):
+        super().__init__(daemon=True)
+        self.name = name
+        self.slot = slot
+        self.uplink = uplink
+        self.quality = quality
+        self.controller = controller
+        self.motion = motion
+        self.skipped = 0
+        # frames of the camera the server had overwritten at the last update
+        self.overwritten = 0
+
+    def run(self):
+        while True:
+            # frames captured during the last send have been dropped
+            (frame, captured) = self.slot.take()
+            loopStart = time.monotonic()
+            md = {"msg": self.name}
+            action = SEND if self.motion is None else self.motion.decide(frame)
+            if action != SEND:
+                # a heartbeat keeps the camera connected without a frame
+                self.skipped += 1
+                if action == HEARTBEAT:
+                    self.uplink.send(dict(md, heartbeat=True), b"")
+                continue
+            if self.controller is not None:
+                # scale the frame down to the chosen width and tell the server
+                # the rate and width the camera is sending at
+                if frame.shape[1] > self.controller.width:
+                    frame = imutils.resize(frame, width=self.controller.width)
+                md.update(fps=round(self.controller.fps, 2), width=frame.shape[1])
+            # the server measures how long ago the frame was captured
+            md["captured"] = round(captured, 6)
+            payload = frame
+            if self.quality:
+                # compress the frame so that it takes a fraction of the uplink
+                (flag, payload) = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+            rtt = self.uplink.send(md, payload, jpeg=bool(self.quality))
+            if self.controller is not None:
+                # the round trip ends before inference, so frames the server
+                # overwrote since the last update tell it is falling behind
+                overwritten = self.uplink.overwritten.get(self.name, 0)
+                self.controller.update(rtt, max(0, overwritten - self.overwritten))
+                self.overwritten = overwritten
+                time.sleep(max(0.0, loopStart + 1.0 / self.controller.fps - time.monotonic()))
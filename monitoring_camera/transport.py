@@ -0,0 +1,325 @@
+# transport.py
+
+"""
+This module contains the senders the camera client can push its frames to the server with
+"""
+
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent import futures
+
+import zmq
+from imagezmq.imagezmq import SerializingContext
+
+
+class PushSender:
+    """
+    Sends frames on a PUSH socket without waiting for a reply from the server. Once the high-water mark
+    is reached the frame is dropped instead of queued, so the camera never blocks on a slow server.
+    Mirrors the imagezmq.ImageSender interface so that it can be used in its place.
+    """
+
+    def __init__(self, connect_to='tcp://127.0.0.1:5555', hwm=2):
+        self.zmq_context = SerializingContext()
+        self.zmq_socket = self.zmq_context.socket(zmq.PUSH)
+        self.zmq_socket.setsockopt(zmq.SNDHWM, hwm)
+        # do not queue frames while the server is not connected
+        self.zmq_socket.setsockopt(zmq.IMMEDIATE, 1)
+        # do not hang on exit with frames that will never be delivered
+        self.zmq_socket.setsockopt(zmq.LINGER, 0)
+        self.zmq_socket.connect(connect_to)
+        # several cameras may push on the socket at once
+        self.lock = threading.Lock()
+        self.dropped = 0
+
+    def send_image(self, msg, image):
+        return self.send(self.zmq_socket.send_array, msg, image)
+
+    def send_jpg(self, msg, jpg_buffer):
+        return self.send(self.zmq_socket.send_jpg, msg, jpg_buffer)
+
+    def send(self, method, msg, payload):
+        """
+        Function sends a frame unless the socket's queue is full
+        :param method: send_array or send_jpg of the socket
+        :param msg: Name of the camera
+        :param payload: Frame or JPEG buffer
+        :return: True if the frame was queued, False if it was dropped
+        """
+        try:
+            method(msg, payload, flags=zmq.NOBLOCK, copy=False)
+            return True
+        except zmq.Again:
+            self.dropped += 1
+            return False
+
+    def close(self):
+        self.zmq_socket.close()
+        self.zmq_context.term()
+
+
+class DealerSender:
+    """
+    Sends frames on a DEALER socket for several threads at once, each waiting for the acknowledgement of
+    its own frame while the frames of the others are in flight. The server replies to the frames of a
+    connection in the order they arrived, so replies are matched to frames in the order they were sent.
+    A thread of its own owns the socket, the senders handing it their frames over an inproc socket.
+    Both imagezmq REP hubs and ROUTER servers reply to the empty delimiter REQ senders put first.
+    """
+
+    def __init__(self, connect_to='tcp://127.0.0.1:5555', timeout=None):
+        self.zmq_context = zmq.Context()
+        self.zmq_socket = self.zmq_context.socket(zmq.DEALER)
+        # do not hang on exit with frames that will never be acknowledged
+        self.zmq_socket.setsockopt(zmq.LINGER, 0)
+        self.zmq_socket.connect(connect_to)
+        self.timeout = timeout
+        self.inbox = self.zmq_context.socket(zmq.PULL)
+        self.inbox.bind("inproc://frames")
+        self.outbox = self.zmq_context.socket(zmq.PUSH)
+        self.outbox.connect("inproc://frames")
+        # the senders take turns handing over their frames, which are
+        # acknowledged in the order of the replies waited for
+        self.lock = threading.Lock()
+        self.pending = deque()
+        self.closed = False
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        # pass the frames handed over on to the server and hand every reply
+        # to the oldest frame waiting for one, until an empty message stops it
+        poller = zmq.Poller()
+        poller.register(self.inbox, zmq.POLLIN)
+        poller.register(self.zmq_socket, zmq.POLLIN)
+        while True:
+            events = dict(poller.poll())
+            if self.inbox in events:
+                parts = self.inbox.recv_multipart(copy=False)
+                if len(parts) == 1:
+                    return
+                self.zmq_socket.send_multipart([b""] + parts, copy=False)
+            if self.zmq_socket in events:
+                reply = self.zmq_socket.recv_multipart()[-1]
+                with self.lock:
+                    if self.pending:
+                        self.pending.popleft().set_result(reply)
+
+    def request(self, md, payload):
+        """
+        Function sends a frame and waits for the server to acknowledge it
+        :param md: Metadata dictionary
+        :param payload: Raw frame, JPEG buffer or bytes
+        :return: Acknowledgement of the server
+        """
+        reply = futures.Future()
+        with self.lock:
+            if self.closed:
+                raise zmq.ZMQError(zmq.ENOTSOCK)
+            self.pending.append(reply)
+            self.outbox.send_json(md, zmq.SNDMORE)
+            self.outbox.send(payload, copy=False)
+        try:
+            return reply.result(self.timeout)
+        except futures.TimeoutError:
+            # like a REQ socket that timed out, the connection is given up
+            raise zmq.Again()
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            self.outbox.send(b"")
+        self.thread.join()
+        # the frames still waiting will never be acknowledged
+        for reply in self.pending:
+            if not reply.done():
+                reply.set_exception(zmq.ZMQError(zmq.ENOTSOCK))
+        self.pending.clear()
+        self.outbox.close()
+        self.inbox.close()
+        self.zmq_socket.close()
+        self.zmq_context.term()
+
+
+def send_frame(sender, md, payload, jpeg=False):
+    """
+    Function sends a frame along with extra metadata the imagezmq send methods have no room for
+    :param sender: DealerSender or PushSender
+    :param md: Metadata dictionary, holding the camera name under "msg"
+    :param payload: Raw frame, JPEG buffer or bytes
+    :param jpeg: True if the payload is a JPEG buffer
+    :return: Acknowledgement of the server for a DealerSender, True if a PushSender queued the frame and
+        False if it dropped it
+    """
+    # raw frames are described so that the server can rebuild the array,
+    # JPEG buffers are recognised by the missing description. The caller
+    # says which it sent: depending on the OpenCV version imencode returns
+    # a flat or an (N, 1) buffer, which cannot be told from a frame
+    if not jpeg and not isinstance(payload, bytes):
+        md = dict(md, dtype=str(payload.dtype), shape=payload.shape)
+    if isinstance(sender, PushSender):
+        with sender.lock:
+            try:
+                sender.zmq_socket.send_json(md, zmq.SNDMORE | zmq.NOBLOCK)
+            except zmq.Again:
+                sender.dropped += 1
+                return False
+            # a multipart message is queued whole once its first part is
+            sender.zmq_socket.send(payload, copy=False)
+            return True
+    return sender.request(md, payload)
+
+
+def open_sender(server_ip, transport, port=5555, hwm=2, timeout=None):
+    """
+    Function connects to the server the frames are sent to
+    :param server_ip: IP address of the server
+    :param transport: Either 'reqrep' to have every frame acknowledged or 'pushpull'
+    :param port: TCP port the server listens on
+    :param hwm: High-water mark of the PUSH socket, ignored for REQ/REP
+    :param timeout: Seconds to wait for the server to acknowledge a frame, None to wait forever. A
+        missing acknowledgement raises zmq.Again instead of blocking
+    :return: DealerSender or PushSender
+    """
+    address = "tcp://{}:{}".format(server_ip, port)
+    if transport == "pushpull":
+        return PushSender(connect_to=address, hwm=hwm)
+    return DealerSender(connect_to=address, timeout=timeout)
+
+
+def parse_acknowledgement(reply):
+    """
+    Function reads the acknowledgement of the server
+    :param reply: Bytes of the reply
+    :return: Tuple of the time of the server and the number of frames of the camera the server overwrote
+        before processing them, each None if the server did not send it
+    """
+    fields = reply.split()
+    try:
+        server = float(fields[0])
+    except (IndexError, ValueError):
+        # servers acknowledging with a plain OK give neither
+        return None, None
+    return server, int(fields[1]) if len(fields) > 1 else None
+
+
+class ClockOffset:
+    """
+    Estimates how far the clock of the server is ahead of the clock of the camera from the
+    acknowledgements, which carry the time the server replied at. The reply is assumed to have been
+    sent halfway through the round trip; of the recent samples the one with the shortest round trip
+    was delayed the least by queueing and is the one trusted.
+    """
+
+    def __init__(self, window=32):
+        self.samples = deque(maxlen=window)
+        self.offset = None
+
+    def add(self, sent, server, acked):
+        """
+        Function records a round trip
+        :param sent: Time of the camera the frame was sent at
+        :param server: Time of the server in the acknowledgement
+        :param acked: Time of the camera the acknowledgement arrived at
+        """
+        self.samples.append((acked - sent, server - (sent + acked) / 2))
+        self.offset = min(self.samples)[1]
+
+
+class Uplink:
+    """
+    Connection to the server that survives the server going away. A send that fails or is not
+    acknowledged in time closes the connection, and a new one is opened after a delay that doubles
+    with every failure in a row, so a camera neither gives up nor hammers a server that is down.
+    Several cameras may share one connection, their frames being numbered apart and in flight together.
+    """
+
+    def __init__(self, server_ip, transport, hwm=2, timeout=5.0, backoff=0.5, max_backoff=30.0):
+        self.options = {"server_ip": server_ip, "transport": transport, "hwm": hwm, "timeout": timeout}
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.delay = backoff
+        self.retryAt = 0.0
+        self.sender = None
+        # guards the connection and the counters, but not the round trips,
+        # of the cameras sharing it
+        self.lock = threading.Lock()
+        self.clock = ClockOffset()
+        # sequence number of the last frame sent by every camera, numbered
+        # under a session of their own so the server knows when they restart
+        self.session = uuid.uuid4().hex[:8]
+        self.sequences = {}
+        # frames of every camera the server overwrote before processing them,
+        # as its last acknowledgement reported
+        self.overwritten = {}
+        self.sent = 0
+        self.dropped = 0
+        self.reconnects = 0
+
+    def send(self, md, payload, jpeg=False):
+        """
+        Function numbers a frame and sends it with the clock offset of the camera, reconnecting first if
+        the last send failed
+        :param md: Metadata dictionary, holding the camera name under "msg"
+        :param payload: Raw frame, JPEG buffer or bytes
+        :param jpeg: True if the payload is a JPEG buffer
+        :return: Seconds from sending the frame to its acknowledgement, or to a PushSender queueing it,
+            None if the frame was dropped
+        """
+        # a camera that was not sending when the connection failed waits out
+        # the delay too
+        time.sleep(max(0.0, self.retryAt - time.monotonic()))
+        with self.lock:
+            if self.sender is None:
+                self.sender = open_sender(**self.options)
+            sender = self.sender
+            seq = self.sequences.get(md["msg"], 0) + 1
+            md = dict(md, seq=seq, session=self.session)
+            if self.clock.offset is not None:
+                md["clock_offset"] = round(self.clock.offset, 6)
+        # the frames of the cameras sharing the connection are in flight
+        # together, only the round trip of this one being timed
+        try:
+            start = time.time()
+            sent = send_frame(sender, md, payload, jpeg)
+            acked = time.time()
+        except zmq.ZMQError as e:
+            with self.lock:
+                # the frame may have reached the server, so its number is used
+                # up and the server counts it as lost if it did not
+                self.sequences[md["msg"]] = seq
+                self.dropped += 1
+                # the first camera to see the connection fail closes it
+                if self.sender is sender:
+                    print("[INFO] sending failed ({}), reconnecting in {:.1f}s".format(e, self.delay))
+                    self.close()
+                    self.reconnects += 1
+                    self.retryAt = time.monotonic() + self.delay
+                    self.delay = min(self.max_backoff, self.delay * 2)
+            # wait before reconnecting without holding up the other cameras
+            time.sleep(max(0.0, self.retryAt - time.monotonic()))
+            return None
+        with self.lock:
+            self.delay = self.backoff
+            if not sent:
+                # a PushSender dropped the frame at its high-water mark
+                self.dropped += 1
+                return None
+            if isinstance(sent, bytes):
+                (server, overwritten) = parse_acknowledgement(sent)
+                if server is not None:
+                    self.clock.add(start, server, acked)
+                if overwritten is not None:
+                    self.overwritten[md["msg"]] = overwritten
+            self.sequences[md["msg"]] = seq
+            self.sent += 1
+            return acked - start
+
+    def close(self):
+        if self.sender is not None:
+            self.sender.close()
+            self.sender = None
+            # the server may come back on another host
+            self.clock = ClockOffset()
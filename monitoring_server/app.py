@@ -1,19 +1,76 @@
-from flask import Flask,Response,render_template
+from flask import Flask,Response,render_template,jsonify,abort,request,send_file
 import threading
 import argparse
-from imutils import build_montages
-from datetime import datetime
+import asyncio
+import atexit
+import time
 import numpy as np
-import imagezmq
 import imutils
 import cv2
 
-# construct the argument parser and parse the arguments
+from batching import collect_batch
+from detection import detect_batch, class_mask, filter_detections
+from ingest import FrameSlots, CameraSequence
+from broadcast import FrameBroadcaster
+from transport import JpegFrame, open_hub, recv_frame, decode, acknowledgement
+from tracking import CameraTracker, DetectionScheduler
+from motion import MotionGate
+from montage import MontageCanvas
+from pool import InferencePool
+from detectors import ENGINES, BACKENDS, TARGETS, load_net, net_options
+from metrics import Metrics
+from liveness import LivenessMonitor
+from clips import ClipRecorder, ClipError
+from archive import Archive, ArchiveError
+from broker import Broker, WorkerLink, ResultCollector
 
-Output_frame = None
-
-# initialize the ImageHub object
-imageHub = imagezmq.ImageHub()
+# initialize the per-camera slots the frames are handed to the inference
+# workers through
+slots = FrameSlots()
+# initialize the per-camera sequencing that puts the frames of every camera
+# in order and counts the ones lost on the way, and the offset of the
+# clock of every camera to the clock of the server the camera reported
+sequences = {}
+clockOffsets = {}
+# initialize the ROUTER hub, when frames are received by the asyncio
+# ingest service
+ingest = None
+# initialize the broker handing the cameras to the recognition workers and
+# the latest detections the workers reported, in broker mode, and the link
+# of a worker to the broker and the aggregator, in worker mode
+broker = None
+detections = {}
+uplink = None
+# initialize the per-camera stage timings served on /metrics
+metrics = Metrics()
+# initialize the montage canvas every camera paints its tile of, the
+# broadcaster the montage is served to the viewers through, and the
+# dictionary of broadcasters serving each camera on its own. Encodings of
+# the montage are timed under an empty camera name, and the capture time of
+# the frame in every tile is kept to time each camera once its tile is seen
+montage = None
+montageCaptured = {}
+montageTimed = {}
+montageFeed = FrameBroadcaster(timer=lambda seconds: metrics.observe("encode", [""], seconds),
+                               latency=lambda captured: montage_latency(captured))
+cameraFeeds = {}
+# initialize the dictionary of trackers that follow the detections of each
+# camera between detector runs, and the scheduler deciding how often the
+# detector runs
+trackers = {}
+scheduler = None
+# initialize the dictionary of motion gates that let the detector skip the
+# frames of a static scene
+gates = {}
+# initialize the recorder keeping the last seconds of every camera so that
+# a clip of what led up to an alert can be cut, when enabled
+clips = None
+# initialize the archive keeping a low frame rate recording of every
+# camera, when enabled
+archive = None
+# initialize the pool of detector processes, used instead of a network per
+# worker thread when detection is spread over several processes
+pool = None
 # initialize the list of class labels MobileNet SSD was trained to
 # detect, then generate a set of bounding box colors for each class
 CLASSES = ["background","bottle","cat", "chair", "dog","person", "pottedplant","sofa", "tvmonitor"]
@@ -23,19 +80,25 @@ print("[INFO] loading model...")
 # initialize the consider set (class labels we care about and want
 # to count), the object count dictionary, and the frame  dictionary
 CONSIDER = set(["dog", "person"])
+CONSIDER_MASK = class_mask(CLASSES, CONSIDER)
 objCount = {obj: 0 for obj in CONSIDER}
 frameDict = {}
-# initialize the dictionary which will contain  information regarding
-# when a device was last active, then store the last time the check
-# was made was now
-lastActive = {}
-lastActiveCheck = datetime.now()
 # stores the estimated number of Pis, active checking period, and
-# calculates the duration seconds to wait before making a check to
-# see if a device was active
+# calculates the default duration seconds a device may stay silent before
+# it is considered disconnected. It has to be well over the longest gap
+# between the messages of a camera: its slowest frame rate, its heartbeat
+# interval while the scene is static and a short reconnect
 ESTIMATED_NUM_PIS = 1
-ACTIVE_CHECK_PERIOD = 1
+ACTIVE_CHECK_PERIOD = 5
 ACTIVE_CHECK_SECONDS = ESTIMATED_NUM_PIS * ACTIVE_CHECK_PERIOD
+# initialize the liveness monitor which contains the dictionary of when
+# each device was last active and announces the devices that connect and
+# those that went silent
+liveness = LivenessMonitor(ACTIVE_CHECK_SECONDS)
+lastActive = liveness.lastActive
+# initialize the dictionary of the frame rate and width each adaptive
+# camera last reported sending at
+sendRates = {}
 
 
 print("[INFO] detecting: {}...".format(", ".join(obj for obj in CONSIDER)))
@@ -51,106 +114,596 @@ def index():
 
 @app.route("/feed")
 def feed():
-    return Response(generate(),
+    return Response(montageFeed.stream(),
+                    mimetype="multipart/x-mixed-replace;boundary=frame")
+
+
+@app.route("/feed/<path:client_name>")
+def camera_feed(client_name):
+    if client_name not in cameraFeeds:
+        abort(404)
+    return Response(cameraFeeds[client_name].stream(),
                     mimetype="multipart/x-mixed-replace;boundary=frame")
 
-def generate():
-    global Output_frame,lock
+@app.route("/snapshot/<path:client_name>.jpg")
+def camera_snapshot(client_name):
+    jpeg = cameraFeeds[client_name].snapshot() if client_name in cameraFeeds else None
+    if jpeg is None:
+        abort(404)
+    return Response(jpeg, mimetype="image/jpeg")
+
+@app.route("/stats")
+def stats():
+    counters = slots.stats()
+    for (ClientName, tracker) in list(trackers.items()):
+        counters.setdefault(ClientName, {}).update(tracker.stats())
+    for (ClientName, gate) in list(gates.items()):
+        counters.setdefault(ClientName, {}).update(gate.stats())
+    if clips is not None:
+        for (ClientName, buffered) in clips.stats().items():
+            counters.setdefault(ClientName, {}).update(buffered)
+    if archive is not None:
+        for (ClientName, archived) in archive.stats().items():
+            counters.setdefault(ClientName, {}).update(archived)
+    for (ClientName, sequence) in list(sequences.items()):
+        counters.setdefault(ClientName, {}).update(sequence.stats())
+    for (ClientName, offset) in list(clockOffsets.items()):
+        counters.setdefault(ClientName, {})["clock_offset"] = offset
+    # how long ago the camera captured the frames its viewers were last sent
+    for (ClientName, quantiles) in metrics.quantiles("capture_to_display").items():
+        counters.setdefault(ClientName, {}).update(
+            {"latency_p{}".format(int(q * 100)): seconds for (q, seconds) in quantiles.items()})
+    if broker is not None:
+        for (ClientName, forwarded) in broker.stats().items():
+            counters.setdefault(ClientName, {}).update(forwarded)
+    for (ClientName, detected) in list(detections.items()):
+        counters.setdefault(ClientName, {}).update(detected)
+    for (ClientName, rate) in list(sendRates.items()):
+        counters.setdefault(ClientName, {}).update(rate)
+    return jsonify(counters)
+
+@app.route("/clip/<path:client_name>.mp4")
+def camera_clip(client_name):
+    if clips is None or clips.keyframe(client_name) is None:
+        abort(404)
+    try:
+        clip = clips.clip(client_name, request.args.get("seconds", type=float))
+    except ClipError as e:
+        abort(503, description=str(e))
+    return Response(clip, mimetype="video/mp4")
+
+@app.route("/archive/<path:client_name>.jpg")
+def archived_frame(client_name):
+    if archive is None:
+        abort(404)
+    try:
+        (frame, frameTime) = archive.read_frame(client_name, request.args.get("t", 0, type=float))
+    except ArchiveError as e:
+        abort(404, description=str(e))
+    (flag, encodedImage) = cv2.imencode(".jpg", frame)
+    return Response(encodedImage.tobytes(), mimetype="image/jpeg", headers={"X-Archive-Time": str(frameTime)})
+
+@app.route("/archive/<path:client_name>.mp4")
+def archived_segment(client_name):
+    # serve the segment holding the requested time, telling the player how
+    # far into the segment that time is
+    if archive is None:
+        abort(404)
+    try:
+        (path, offset, frameTime) = archive.locate(client_name, request.args.get("t", 0, type=float))
+    except ArchiveError as e:
+        abort(404, description=str(e))
+    response = send_file(path, mimetype="video/mp4")
+    response.headers["X-Archive-Offset"] = str(offset / archive.fps)
+    response.headers["X-Archive-Time"] = str(frameTime)
+    return response
+
+@app.route("/clip/<path:client_name>.jpg")
+def camera_keyframe(client_name):
+    jpeg = clips.keyframe(client_name) if clips is not None else None
+    if jpeg is None:
+        abort(404)
+    return Response(jpeg, mimetype="image/jpeg")
+
+@app.route("/metrics")
+def prometheus_metrics():
+    counters = slots.stats()
+    series = [("monitoring_camera_queue_depth", "gauge", "Frames waiting for an inference worker per camera",
+               {ClientName: counter["pending"] for (ClientName, counter) in counters.items()}),
+              ("monitoring_camera_viewers", "gauge", "Viewers connected to the feed of each camera",
+               {ClientName: feed.viewers for (ClientName, feed) in list(cameraFeeds.items())}),
+              ("monitoring_montage_viewers", "gauge", "Viewers connected to the montage feed",
+               {None: montageFeed.viewers})]
+    if clips is not None:
+        series.append(("monitoring_camera_clip_bytes", "gauge", "Memory held by the pre-event buffer of each camera",
+                       {ClientName: buffered["clip_bytes"] for (ClientName, buffered) in clips.stats().items()}))
+    for counter in ("received", "dropped", "processed"):
+        series.append(("monitoring_camera_frames_{}_total".format(counter), "counter",
+                       "Frames {} per camera".format(counter),
+                       {ClientName: values[counter] for (ClientName, values) in counters.items()}))
+    series.append(("monitoring_camera_frames_missing_total", "counter",
+                   "Frames lost between each camera and the server, from the gaps in their sequence numbers",
+                   {ClientName: sequence.missing for (ClientName, sequence) in list(sequences.items())}))
+    return Response(metrics.render(series), mimetype="text/plain; version=0.0.4")
+
+
+def receive(imageHub, slots):
     while True:
-        if Output_frame is None:
+        # evict the devices that have not sent anything for longer than
+        # the liveness timeout, then wait for a frame no longer than until
+        # the next device may go stale
+        liveness.expire()
+        deadline = liveness.next_deadline()
+        timeout = None if deadline is None else int(max(0.0, deadline - time.monotonic()) * 1000) + 1
+        if not imageHub.zmq_socket.poll(timeout):
             continue
-        (flag,encodedImage)=cv2.imencode(".jpg",Output_frame)
-        if not flag:
+        # receive RPi name and frame from the RPi and acknowledge the receipt
+        # straight away so that a slow inference pass never holds up a camera.
+        # JPEG frames are kept encoded until a worker picks them up. Only the
+        # time spent reading a message that has arrived is timed. The reply
+        # tells the camera how many of its frames were overwritten so far
+        start = time.perf_counter()
+        (md, frame) = recv_frame(imageHub.zmq_socket)
+        imageHub.send_reply(acknowledgement(slots.overwritten(md["msg"])))
+        ClientName = accept(md, frame)
+        metrics.observe("receive", [ClientName], time.perf_counter() - start)
+
+
+def receive_router(hub):
+    # serve the ROUTER socket and evict the devices that went silent on the
+    # same event loop, neither ever blocking the other
+    async def expire():
+        while True:
+            liveness.expire()
+            deadline = liveness.next_deadline()
+            await asyncio.sleep(ACTIVE_CHECK_SECONDS if deadline is None else
+                                max(0.0, deadline - time.monotonic()) + 0.001)
+
+    async def serve():
+        await asyncio.gather(hub.serve(accept), expire())
+
+    asyncio.run(serve())
+
+
+def receive_broker(link):
+    while True:
+        # evict the devices the broker stopped sending, then wait for a
+        # frame no longer than until the next device may go stale
+        liveness.expire()
+        deadline = liveness.next_deadline()
+        received = link.receive(ACTIVE_CHECK_SECONDS if deadline is None else max(0.0, deadline - time.monotonic()))
+        if received is not None:
+            accept(*received)
+
+
+def aggregate(collector, args):
+    while True:
+        # the broker keeps the devices alive with every message it forwards,
+        # heartbeats included, so evict the silent ones even while no result
+        # arrives
+        liveness.expire()
+        deadline = liveness.next_deadline()
+        received = collector.receive(ACTIVE_CHECK_SECONDS if deadline is None else
+                                     max(0.0, deadline - time.monotonic()))
+        if received is None:
             continue
-        yield(b'--frame\r\n'
-              b'Content-Type: image/jpeg\r\n\r\n' + bytearray(encodedImage)+b'\r\n')
+        # serve the frame annotated by a worker as it was encoded there, and
+        # keep the detections it reported
+        (md, jpeg) = received
+        ClientName = md["msg"]
+        liveness.touch(ClientName)
+        detections[ClientName] = {"counts": md["counts"], "detected_at": md["time"]}
+        open_feed(ClientName).publish_jpeg(jpeg, md.get("captured"))
+        metrics.frame([ClientName])
+        frame = decode(JpegFrame(jpeg))
+        if frame is not None:
+            compose({ClientName: frame}, lock, args, {ClientName: md.get("captured")})
 
 
-def recognition(lock, args):
-    net = cv2.dnn.readNetFromCaffe(args["prototxt"], args["model"])
+def accept(md, frame):
+    ClientName = md["msg"]
+    # record the last active time for the device from which we just
+    # received a frame, announcing it if it is newly connected
+    liveness.touch(ClientName)
+    # put the frames of the device in order, dropping the ones overtaken by
+    # a newer frame and counting the ones lost on the way
+    if ClientName not in sequences:
+        sequences[ClientName] = CameraSequence()
+    seq = sequences[ClientName].accept(md.get("seq"), md.get("session"))
+    if seq is None:
+        return ClientName
+    # bring the capture time onto the clock of the server with the offset
+    # the camera estimated from the acknowledgements, and time how long the
+    # frame took to get here
+    captured = None
+    if "captured" in md:
+        captured = md["captured"] + md.get("clock_offset", 0.0)
+        clockOffsets[ClientName] = md.get("clock_offset")
+        metrics.observe("capture_to_receive", [ClientName], time.time() - captured)
+    # log the frame rate and width an adaptive camera switched to
+    if "fps" in md:
+        rate = {"send_fps": md["fps"], "send_width": md.get("width")}
+        if sendRates.get(ClientName) != rate:
+            print("[INFO] {} sending at {} fps, {} pixels wide".format(ClientName, md["fps"], md.get("width")))
+            sendRates[ClientName] = rate
+    # a heartbeat of a camera watching a static scene carries no frame, the
+    # last frame of the device stays on display
+    if md.get("heartbeat"):
+        return ClientName
+    # keep only the latest frame of the device until a worker picks it up,
+    # along with its number and capture time
+    slots.put(ClientName, frame, {"seq": seq, "captured": captured})
+    return ClientName
+
+
+def open_feed(ClientName):
+    # the broadcaster of a device, timing its encodings and how long ago
+    # the frames it encodes for the viewers were captured
+    if ClientName not in cameraFeeds:
+        cameraFeeds[ClientName] = FrameBroadcaster(
+            timer=lambda seconds: metrics.observe("encode", [ClientName], seconds),
+            latency=lambda captured: metrics.observe("capture_to_display", [ClientName], time.time() - captured))
+    return cameraFeeds[ClientName]
+
+
+def on_liveness(event, ClientName):
+    if event == "connect":
+        print("[INFO] receiving data from {}...".format(ClientName))
+        return
+    print("[INFO] lost connection to {}".format(ClientName))
+    # release everything kept for the device: its waiting frame, its last
+    # frame and montage tile, and the state of its tracker and motion gate
+    slots.discard(ClientName)
+    with lock:
+        frameDict.pop(ClientName, None)
+        if montage is not None:
+            montage.remove(ClientName)
+            montageCaptured.pop(ClientName, None)
+            montageTimed.pop(ClientName, None)
+            if montage.dirty:
+                montage.dirty = False
+                montageFeed.publish(montage.image, montage.lock, dict(montageCaptured))
+        trackers.pop(ClientName, None)
+        gates.pop(ClientName, None)
+    # a device that returns may have restarted, its numbering and clock
+    # offset start over
+    sequences.pop(ClientName, None)
+    clockOffsets.pop(ClientName, None)
+    sendRates.pop(ClientName, None)
+    # a broker no longer counts the device towards the load of its worker
+    if broker is not None:
+        broker.forget(ClientName)
+    # free the pre-event buffer of the device, a returning device starts a
+    # new one
+    if clips is not None:
+        clips.discard(ClientName)
+    # close the last segment of the device in the background, as this runs
+    # on the thread receiving every camera. A new one starts if it returns
+    if archive is not None:
+        archive.close(ClientName, wait=False)
+    # the feed of the device is kept while viewers wait for it to return
+    if ClientName in cameraFeeds and not cameraFeeds[ClientName].viewers:
+        cameraFeeds.pop(ClientName)
+
+
+liveness.subscribe(on_liveness)
+
+
+def load_detector(args):
+    # use the pool of detector processes when there is one, otherwise load
+    # a network for this worker alone
+    if pool is not None:
+        return pool.detect
+    net = load_net(**net_options(args))
 
-    # assign montage width and height so we can view all incoming frames
-    # in a single "dashboard"
-    mW = args["montageW"]
-    mH = args["montageH"]
+    def detect(frames, timings=None):
+        return dict(zip(frames, detect_batch(net, list(frames.values()), timings)))
+
+    return detect
+
+
+def recognition(lock, args):
+    detect = load_detector(args)
 
     while True:
-        # receive RPi name and frame from the RPi and acknowledge
-        # the receipt
-        (ClientName, frame) = imageHub.recv_image()
-        imageHub.send_reply(b'OK')
-        # if a device is not in the last active dictionary then it means
-        # that its a newly connected device
-        if ClientName not in lastActive.keys():
-            print("[INFO] receiving data from {}...".format(ClientName))
-        # record the last active time for the device from which we just
-        # received a frame
-        lastActive[ClientName] = datetime.now()
-
-    # resize the frame to have a maximum width of 400 pixels, then
-        # grab the frame dimensions and construct a blob
-        frame = imutils.resize(frame, width=400)
+        # wait for a frame to be available, timing how long the worker idles,
+        # then gather the latest frame of every camera that reports within
+        # the batching window
+        waitStart = time.monotonic()
+        slots.wait()
+        workStart = time.monotonic()
+        batch = collect_batch(slots, args["batch_size"], args["batch_wait"])
+
+        # time every stage, charging the time of a stage to every camera of
+        # the batch as each of their frames waited for it
+        start = time.perf_counter()
+        frames = prepare(batch)
+        if frames:
+            timings = {"prepare": time.perf_counter() - start}
+            start = time.perf_counter()
+            results = infer(detect, frames, args, timings)
+            # a failed detector process only costs the frames of its cameras
+            # that neither the tracker nor the motion gate has detections for
+            frames = {ClientName: frame for (ClientName, frame) in frames.items() if ClientName in results}
+        if frames:
+            timings["infer"] = time.perf_counter() - start
+            start = time.perf_counter()
+            annotate(frames, results, args)
+            timings["annotate"] = time.perf_counter() - start
+            # the montage of a broker worker is painted by the aggregator
+            if uplink is None:
+                start = time.perf_counter()
+                compose(frames, lock, args,
+                        {ClientName: (slots.stamp(ClientName) or {}).get("captured") for ClientName in frames})
+                timings["compose"] = time.perf_counter() - start
+            # timings also holds the blob and forward pass times of the batch
+            for (stage, seconds) in timings.items():
+                metrics.observe(stage, frames, seconds)
+            metrics.frame(frames)
+        # let the workers pick up the next frames of these devices
+        slots.done(batch)
+        if scheduler is not None:
+            scheduler.record(workStart - waitStart, time.monotonic() - workStart)
+
+
+def prepare(batch):
+    # decode the frames sent as JPEG and resize the frames to have a
+    # maximum width of 400 pixels, skipping any buffer that is not a
+    # valid image
+    frames = {}
+    for (ClientName, received) in batch.items():
+        frame = decode(received)
+        if frame is not None:
+            frames[ClientName] = imutils.resize(frame, width=400)
+            # keep the frame in the pre-event buffer of the device, as the
+            # JPEG it was sent as when there is one
+            if clips is not None:
+                jpeg = bytes(received.buffer) if isinstance(received, JpegFrame) else None
+                clips.record(ClientName, frames[ClientName], jpeg)
+    return frames
+
+
+def infer(detect, frames, args, timings=None):
+    # only look for objects in the frames of devices whose scene changed,
+    # the others keep the detections of their last detector run
+    moving = frames
+    if args["motion_threshold"]:
+        cameraGates = {ClientName: camera_state(gates, ClientName, lambda: MotionGate(
+            args["motion_threshold"], args["motion_interval"], args["motion_method"])) for ClientName in frames}
+        moving = {ClientName: frame for (ClientName, frame) in frames.items() if cameraGates[ClientName].check(frame)}
+
+    if scheduler is None:
+        # pass the frames through the network as a single blob and obtain
+        # the detections of each frame
+        results = detect(moving, timings)
+    else:
+        results = detect_or_track(detect, moving, args, timings)
+
+    if args["motion_threshold"]:
+        for ClientName in frames:
+            if ClientName in results:
+                cameraGates[ClientName].remember(results[ClientName])
+            else:
+                results[ClientName] = cameraGates[ClientName].rows
+    return results
+
+
+def camera_state(states, ClientName, create):
+    # the tracker or motion gate of a device for the batch being processed.
+    # A new one is only kept while the device is active, under the lock the
+    # eviction of the device takes, so that a device evicted while its frame
+    # was processed neither breaks the batch nor leaves state behind
+    state = states.get(ClientName)
+    if state is None:
+        state = create()
+        with lock:
+            if ClientName in lastActive:
+                states[ClientName] = state
+    return state
+
+
+def annotate(frames, results, args):
+    for (ClientName, frame) in frames.items():
+        detections = results[ClientName]
         (h, w) = frame.shape[:2]
-        blob = cv2.dnn.blobFromImage(cv2.resize(frame, (300, 300)),0.007843, (300, 300), 127.5)
-        # pass the blob through the network and obtain the detections and
-        # predictions
-        net.setInput(blob)
-        detections = net.forward()
-        # reset the object count for each object in the CONSIDER set
-        objCount = {obj: 0 for obj in CONSIDER}
-
-        for i in np.arange(0, detections.shape[2]):
-            # extract the confidence (i.e., probability) associated with
-            # the prediction
-            confidence = detections[0, 0, i, 2]
-            # filter out weak detections by ensuring the confidence is
-            # greater than the minimum confidence
-            if confidence > args["confidence"]:
-                # extract the index of the class label from the
-                # detections
-                idx = int(detections[0, 0, i, 1])
-                # check to see if the predicted class is in the set of
-                # classes that need to be considered
-                try:
-                    if CLASSES[idx] in CONSIDER:
-                        # increment the count of the particular object
-                        # detected in the frame
-                        objCount[CLASSES[idx]] += 1
-                        # compute the (x, y)-coordinates of the bounding box
-                        # for the object
-                        box = detections[0, 0, i, 3:7] * np.array([w, h, w, h])
-                        (startX, startY, endX, endY) = box.astype("int")
-                        # draw the bounding box around the detected object on
-                        # the frame
-                        cv2.rectangle(frame, (startX, startY), (endX, endY),
-                                      (255, 0, 0), 2)
-                except:
-                    pass
+        # keep the confident detections of the classes in the CONSIDER
+        # set, with their bounding boxes scaled to the frame
+        (boxes, classIds) = filter_detections(detections, args["confidence"], CONSIDER_MASK, (w, h), args["nms"])
+        # count the objects of every class detected in the frame
+        counts = np.bincount(classIds, minlength=len(CLASSES))
+        objCount = {obj: int(counts[CLASSES.index(obj)]) for obj in CONSIDER}
+        # draw the bounding boxes around the detected objects on the frame
+        for (startX, startY, endX, endY) in boxes:
+            cv2.rectangle(frame, (startX, startY), (endX, endY), (255, 0, 0), 2)
 
         # draw the sending device name on the frame
         cv2.putText(frame, ClientName, (10, 25),cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 255), 2)
         # draw the object count on the frame
         label = ", ".join("{}: {}".format(obj, count) for (obj, count) in objCount.items())
         cv2.putText(frame, label, (10, h - 20),cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255,0), 2)
-        # update the new frame in the frame dictionary
-        frameDict[ClientName] = frame
-        # build a montage using images in the frame dictionary
-        montages = build_montages(frameDict.values(), (w, h), (mW, mH))
-        # display the montage(s) on the screen
-        for (i, montage) in enumerate(montages):
-            with lock:
-                global Output_frame
-                Output_frame = montage.copy()
+        # hand the annotated frame to the viewers of this device alone, or to
+        # the aggregator serving them when this is a broker worker
+        stamp = slots.stamp(ClientName) or {}
+        if uplink is not None:
+            start = time.perf_counter()
+            (flag, encodedImage) = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, 80])
+            metrics.observe("encode", [ClientName], time.perf_counter() - start)
+            if flag:
+                uplink.publish(ClientName, encodedImage.tobytes(), objCount, stamp)
+        else:
+            open_feed(ClientName).publish(frame, captured=stamp.get("captured"))
+        # record the annotated frame under the time the camera captured it,
+        # the archive keeping only the frames due at its frame rate
+        if archive is not None:
+            archive.add(ClientName, frame, stamp.get("captured"))
+
 
+def compose(frames, lock, args, captured=None):
+    global montage
+    with lock:
+        # leave out the devices evicted while their frame was processed
+        frames = {ClientName: frame for (ClientName, frame) in frames.items() if ClientName in lastActive}
+        if not frames:
+            return
+        # update the new frames in the frame dictionary
+        frameDict.update(frames)
+        # repaint the tiles of these devices only, then hand the montage
+        # to the viewers if any tile changed. The tiles take the size of
+        # the first frame, montage width and height being assigned so we
+        # can view all incoming frames in a single "dashboard"
+        if montage is None:
+            (h, w) = next(iter(frames.values())).shape[:2]
+            montage = MontageCanvas((w, h), args["montageW"], args["montageH"])
+        for (ClientName, frame) in frames.items():
+            montage.update(ClientName, frame)
+            montageCaptured[ClientName] = (captured or {}).get(ClientName)
+        if montage.dirty:
+            montage.dirty = False
+            montageFeed.publish(montage.image, montage.lock, dict(montageCaptured))
+
+
+def montage_latency(captured):
+    # time the tiles whose frame changed since the montage was last seen
+    for (ClientName, stamp) in captured.items():
+        if stamp is not None and montageTimed.get(ClientName) != stamp:
+            montageTimed[ClientName] = stamp
+            metrics.observe("capture_to_display", [ClientName], time.time() - stamp)
+
+
+def detect_or_track(detect, frames, args, timings=None):
+    # only run the detector on the devices whose detections are too old or
+    # no longer tracked reliably, and follow the previous detections of the
+    # other devices with the tracker
+    cameraTrackers = {ClientName: camera_state(trackers, ClientName, CameraTracker) for ClientName in frames}
+    due = [ClientName for ClientName in frames
+           if cameraTrackers[ClientName].due(scheduler.interval, args["track_confidence"])]
+    results = detect({ClientName: frames[ClientName] for ClientName in due}, timings)
+    for (ClientName, frame) in frames.items():
+        if ClientName in results:
+            # only follow the detections strong enough to be drawn
+            detections = results[ClientName]
+            cameraTrackers[ClientName].reset(frame, detections[detections[:, 2] > args["confidence"]])
+        else:
+            results[ClientName] = cameraTrackers[ClientName].track(frame)
+    return results
+
+
+
+def build_parser():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("-p", "--prototxt", default="prototxt.txt", help="path to the Caffe deploy prototxt file")
+    ap.add_argument("-m", "--model", default="caffemodel", help="path to the pre-trained Caffe or ONNX model")
+    ap.add_argument("-e", "--engine", choices=ENGINES, default="caffe",
+                    help="caffe or onnx to run the model with cv2.dnn, onnxruntime to run an ONNX model with onnxruntime")
+    ap.add_argument("--backend", choices=sorted(BACKENDS), default="default", help="cv2.dnn backend")
+    ap.add_argument("--target", choices=sorted(TARGETS), default="cpu", help="cv2.dnn target device")
+    ap.add_argument("-c", "--confidence", type=float, default=0.8, help="minimum probability to filter weak detections")
+    ap.add_argument("-mW", "--montageW", type=int, default=1, help="number of columns in the montage")
+    ap.add_argument("-mH", "--montageH", type=int, default=1, help="number of rows in the montage")
+    ap.add_argument("-b", "--batch-size", type=int, default=8, help="maximum number of cameras in one inference batch")
+    ap.add_argument("-w", "--batch-wait", type=float, default=0.02,
+                    help="maximum seconds to wait for other cameras once a batch has started")
+    ap.add_argument("-n", "--workers", type=int, default=1, help="number of inference worker threads")
+    ap.add_argument("-P", "--processes", type=int, default=0,
+                    help="number of detector processes, 0 to run the detector in the worker threads")
+    ap.add_argument("-t", "--transport", choices=["reqrep", "pushpull", "router"], default="reqrep",
+                    help="reqrep to acknowledge every frame, pushpull to receive without replies, "
+                         "router for the asyncio ROUTER ingest service")
+    ap.add_argument("-r", "--role", choices=["standalone", "broker", "worker"], default="standalone",
+                    help="standalone to do everything in one process, broker to hand the cameras to worker "
+                         "processes and serve their results, worker to run recognition for a broker")
+    ap.add_argument("--broker-host", default="localhost", help="host of the broker a worker connects to")
+    ap.add_argument("--active-timeout", type=float, default=ACTIVE_CHECK_SECONDS,
+                    help="seconds a camera may stay silent before it is considered disconnected, well over the "
+                         "slowest frame period and the heartbeat interval of the cameras")
+    ap.add_argument("--hwm", type=int, default=2,
+                    help="frames queued per camera in pushpull and router mode before dropping")
+    ap.add_argument("-d", "--detect-every", type=int, default=1, help="run the detector every this many frames per camera")
+    ap.add_argument("-D", "--max-detect-every", type=int, default=0,
+                    help="upper bound the detection interval may grow to under load, defaults to --detect-every")
+    ap.add_argument("--track-confidence", type=float, default=0.5,
+                    help="fraction of tracked points below which the detector runs again straight away")
+    ap.add_argument("--motion-threshold", type=float, default=0,
+                    help="fraction of changed pixels needed to run the detector, 0 to run it on every frame")
+    ap.add_argument("--motion-interval", type=float, default=5.0,
+                    help="maximum seconds between detector runs on a static scene")
+    ap.add_argument("--motion-method", choices=["diff", "mog2"], default="diff",
+                    help="frame differencing or MOG2 background subtraction")
+    ap.add_argument("--nms", type=float, default=0,
+                    help="overlap above which duplicate boxes of a class are removed, 0 to keep every box")
+    ap.add_argument("--clip-seconds", type=float, default=0,
+                    help="seconds of footage kept per camera for alert clips, 0 to keep none")
+    ap.add_argument("--clip-memory", type=float, default=8,
+                    help="megabytes the footage kept for alert clips may take per camera")
+    ap.add_argument("--archive", default="", help="directory to archive every camera to, empty to archive nothing")
+    ap.add_argument("--archive-fps", type=float, default=1, help="frames per second kept in the archive")
+    ap.add_argument("--archive-segment", type=float, default=60, help="seconds per archive segment")
+    return ap
+
+
+def setup(args):
+    global scheduler, pool, clips, archive
+    args["max_detect_every"] = max(args["max_detect_every"], args["detect_every"])
+    liveness.timeout = args["active_timeout"]
+
+    # track detections between detector runs when the detector is not
+    # required to run on every frame
+    if args["max_detect_every"] > 1:
+        scheduler = DetectionScheduler(args["detect_every"], args["max_detect_every"])
+
+    # keep the last seconds of every camera for alert clips
+    if args["clip_seconds"]:
+        clips = ClipRecorder(args["clip_seconds"], int(args["clip_memory"] * 1024 * 1024))
+
+    # record every camera at a low frame rate, closing the last segments
+    # when the server stops
+    if args["archive"]:
+        archive = Archive(args["archive"], args["archive_fps"], args["archive_segment"])
+        atexit.register(archive.close)
+
+    # spread the detector over several processes, each with its own network
+    if args["processes"]:
+        pool = InferencePool(args["processes"], net_options(args))
+        # release the shared memory of the pool when the server stops
+        atexit.register(pool.close)
 
 
 if __name__ == "__main__":
     
-    args = {'prototxt': "prototxt.txt", 'model': "caffemodel", 'montageW': 1, 'montageH': 1, 'confidence': 0.8}
-
-    t = threading.Thread(target=recognition,args=(lock,args))
+    args = vars(build_parser().parse_args())
+    setup(args)
 
+    if args["role"] == "worker":
+        # take the frames of the cameras the broker assigns to this worker
+        # and send the results back, the viewers being served by the broker
+        uplink = WorkerLink(args["broker_host"], hwm=args["hwm"])
+        t = threading.Thread(target=receive_broker,args=(uplink,))
+    elif args["role"] == "broker":
+        # hand the frames of the cameras to the workers, the results they
+        # send back being collected for the viewers
+        broker = Broker(hwm=args["hwm"], touch=liveness.touch)
+        t = threading.Thread(target=broker.run)
+    elif args["transport"] == "router":
+        # initialize the hub object the cameras send their frames to
+        ingest = open_hub(args["transport"], hwm=args["hwm"], overwritten=slots.overwritten)
+        t = threading.Thread(target=receive_router,args=(ingest,))
+    else:
+        imageHub = open_hub(args["transport"], hwm=args["hwm"])
+        t = threading.Thread(target=receive,args=(imageHub,slots))
     t.daemon= True
     t.start()
 
-    app.run(debug=True,port=5632,host="0.0.0.0",threaded=True,use_reloader=False)
+    if args["role"] == "broker":
+        t = threading.Thread(target=aggregate,args=(ResultCollector(),args))
+        t.daemon= True
+        t.start()
+    else:
+        for _ in range(args["workers"]):
+            t = threading.Thread(target=recognition,args=(lock,args))
+            t.daemon= True
+            t.start()
+
+    if args["role"] == "worker":
+        t.join()
+    else:
+        app.run(debug=True,port=5632,host="0.0.0.0",threaded=True,use_reloader=False)
@@ -0,0 +1,283 @@
+# archive.py
+
+"""
+This module contains the archive that keeps a low frame rate recording of every camera as H.264
+segments, with an index mapping the time of every recorded frame to its place in the segments
+"""
+
+import os
+import queue
+import shutil
+import subprocess
+import threading
+import time
+from urllib.parse import quote
+
+import numpy as np
+import cv2
+
+# layout of an index record: capture time in seconds since the epoch and
+# number of the frame in the recording of the camera
+INDEX_RECORD = np.dtype([("time", "<f8"), ("frame", "<u4")])
+INDEX_FILE = "index.bin"
+SEGMENT_NAME = "{:08d}.mp4"
+
+
+class ArchiveError(Exception):
+    """
+    Raised when the archive of a camera cannot be written or read
+    """
+
+
+def camera_directory(root, name):
+    # camera names may contain slashes, so they are quoted into one directory
+    return os.path.join(root, quote(name, safe=""))
+
+
+class CameraArchive:
+    """
+    Recording of one camera. Frames are queued to a writer thread which pipes them into a single ffmpeg
+    process cutting fixed-length segments, with a keyframe at the start of every segment. The frame
+    number of a frame therefore tells its segment and its offset within it, and the index only has to
+    map times to frame numbers. A recording that follows one still being closed only looks at the
+    directory once that one is done, on its writer thread, so nobody adding frames waits for it.
+    """
+
+    def __init__(self, root, name, fps, segment_seconds, ffmpeg="ffmpeg", queue_size=8, previous=None):
+        self.directory = camera_directory(root, name)
+        self.name = name
+        self.fps = fps
+        self.frames_per_segment = max(int(round(fps * segment_seconds)), 1)
+        self.ffmpeg = ffmpeg
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.process = None
+        self.size = None
+        self.nextDue = 0.0
+        self.written = 0
+        self.dropped = 0
+        os.makedirs(self.directory, exist_ok=True)
+        self.start = time.monotonic()
+        self.startBytes = directory_bytes(self.directory)
+        # thread still closing the previous recording of the camera, if any
+        self.previous = previous
+        self.index = None
+        self.thread = threading.Thread(target=self.write_frames, daemon=True)
+        self.thread.start()
+
+    def open_index(self):
+        # runs on the writer thread once the previous recording is closed
+        if self.previous is not None:
+            self.previous.join()
+            self.startBytes = directory_bytes(self.directory)
+        # drop a record cut short when an earlier recording stopped abruptly
+        path = os.path.join(self.directory, INDEX_FILE)
+        if os.path.exists(path) and os.path.getsize(path) % INDEX_RECORD.itemsize:
+            os.truncate(path, os.path.getsize(path) - os.path.getsize(path) % INDEX_RECORD.itemsize)
+        # continue after the last frame of an earlier recording, at the start
+        # of a new segment so that the earlier segments stay untouched
+        last = last_frame(self.directory)
+        self.segment = 0 if last is None else last // self.frames_per_segment + 1
+        self.frame = self.segment * self.frames_per_segment
+        self.index = open(path, "ab")
+
+    def add(self, frame, timestamp):
+        """
+        Function queues a frame if it is due at the archive frame rate, never blocking the caller
+        :param frame: BGR frame, not modified afterwards
+        :param timestamp: Capture time in seconds since the epoch
+        """
+        if timestamp < self.nextDue:
+            return
+        period = 1.0 / self.fps
+        # keep to the frame rate, but do not catch up on a gap in the footage
+        self.nextDue = self.nextDue + period if timestamp < self.nextDue + period else timestamp + period
+        try:
+            self.queue.put_nowait((timestamp, frame))
+        except queue.Full:
+            self.dropped += 1
+
+    def open_encoder(self, frame):
+        # the frame size of the first frame is kept for the whole recording,
+        # cut down to even dimensions as the encoder requires
+        (h, w) = frame.shape[:2]
+        self.size = (w - w % 2, h - h % 2)
+        command = [self.ffmpeg, "-loglevel", "error", "-f", "rawvideo", "-pix_fmt", "bgr24",
+                   "-s", "{}x{}".format(*self.size), "-r", str(self.fps), "-i", "-",
+                   "-c:v", "libx264", "-preset", "veryfast", "-pix_fmt", "yuv420p",
+                   "-g", str(self.frames_per_segment), "-keyint_min", str(self.frames_per_segment),
+                   "-sc_threshold", "0", "-f", "segment",
+                   "-segment_time", str(self.frames_per_segment / self.fps),
+                   "-segment_start_number", str(self.segment), "-reset_timestamps", "1",
+                   os.path.join(self.directory, SEGMENT_NAME.replace("{:08d}", "%08d"))]
+        self.process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL)
+
+    def write_frames(self):
+        # runs on the writer thread of the camera until close() queues None
+        self.open_index()
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            (timestamp, frame) = item
+            if self.process is None:
+                self.open_encoder(frame)
+            (w, h) = self.size
+            if frame.shape[:2] != (h, w):
+                # an odd row or column is cut, any other size is scaled
+                odd = 0 <= frame.shape[0] - h <= 1 and 0 <= frame.shape[1] - w <= 1
+                frame = frame[:h, :w] if odd else cv2.resize(frame, (w, h))
+            try:
+                self.process.stdin.write(np.ascontiguousarray(frame).data)
+            except (BrokenPipeError, ValueError):
+                break
+            self.index.write(np.array([(timestamp, self.frame)], dtype=INDEX_RECORD).tobytes())
+            self.frame += 1
+            self.written += 1
+            # make the index of a segment visible to readers once it is complete
+            if self.frame % self.frames_per_segment == 0:
+                self.index.flush()
+        self.index.close()
+        if self.process is not None:
+            self.process.stdin.close()
+            self.process.wait()
+
+    def close(self):
+        """
+        Function stops the writer once the queued frames are written and closes the last segment
+        """
+        # a writer whose encoder died has already stopped reading the queue
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+
+    def stats(self):
+        """
+        Function reports the frames written and the bytes the recording added to the disk
+        :return: Dictionary of the written and dropped frame counts and the disk bytes and bytes per second
+        """
+        written = directory_bytes(self.directory) - self.startBytes
+        return {"archive_frames": self.written, "archive_dropped": self.dropped,
+                "archive_bytes": written, "archive_bytes_per_second": written / (time.monotonic() - self.start)}
+
+
+class Archive:
+    """
+    Archives of every camera under one directory. The writers of the cameras are started when their
+    first frame is added.
+    """
+
+    def __init__(self, root, fps=1.0, segment_seconds=60.0, ffmpeg="ffmpeg"):
+        if shutil.which(ffmpeg) is None:
+            raise ArchiveError("{} not found".format(ffmpeg))
+        self.root = root
+        self.fps = fps
+        self.segment_seconds = segment_seconds
+        self.ffmpeg = ffmpeg
+        self.lock = threading.Lock()
+        self.cameras = {}
+        # threads closing the archives of cameras that went away
+        self.closing = {}
+
+    def add(self, name, frame, timestamp=None):
+        """
+        Function hands a frame of a camera to its archive
+        :param name: Name of the camera
+        :param frame: BGR frame, not modified afterwards
+        :param timestamp: Capture time in seconds since the epoch, the current time if None
+        """
+        with self.lock:
+            if name not in self.cameras:
+                # a camera back before its last archive finished closing
+                # resumes after the last frame that archive wrote, its writer
+                # waiting for the close rather than the caller
+                self.cameras[name] = CameraArchive(self.root, name, self.fps, self.segment_seconds, self.ffmpeg,
+                                                   previous=self.closing.pop(name, None))
+            camera = self.cameras[name]
+        camera.add(frame, time.time() if timestamp is None else timestamp)
+
+    def close(self, name=None, wait=True):
+        """
+        Function closes the archive of a camera, or of every camera
+        :param name: Name of the camera, None for every camera
+        :param wait: False to finish the last segment on a background thread instead of waiting for
+            ffmpeg, so that the caller is not held up
+        """
+        with self.lock:
+            names = list(self.cameras) if name is None else [name]
+            closing = [self.cameras.pop(name) for name in names if name in self.cameras]
+            if not wait:
+                for camera in closing:
+                    self.closing[camera.name] = threading.Thread(target=camera.close, daemon=True)
+                    self.closing[camera.name].start()
+                return
+            pending = list(self.closing.values()) if name is None else []
+        for camera in closing:
+            camera.close()
+        for thread in pending:
+            thread.join()
+
+    def locate(self, name, timestamp):
+        """
+        Function finds the first archived frame of a camera at or after a time
+        :param name: Name of the camera
+        :param timestamp: Time in seconds since the epoch
+        :return: Tuple of the segment path, the frame offset within the segment and the frame time
+        """
+        directory = camera_directory(self.root, name)
+        path = os.path.join(directory, INDEX_FILE)
+        if not os.path.exists(path) or os.path.getsize(path) < INDEX_RECORD.itemsize:
+            raise ArchiveError("nothing archived for {}".format(name))
+        # the index is searched in place, only touching the records the
+        # binary search needs
+        index = np.memmap(path, dtype=INDEX_RECORD, mode="r",
+                          shape=(os.path.getsize(path) // INDEX_RECORD.itemsize,))
+        position = int(np.searchsorted(index["time"], timestamp))
+        if position == len(index):
+            raise ArchiveError("nothing archived for {} after {}".format(name, timestamp))
+        (frameTime, frame) = (float(index["time"][position]), int(index["frame"][position]))
+        framesPerSegment = max(int(round(self.fps * self.segment_seconds)), 1)
+        (segment, offset) = divmod(frame, framesPerSegment)
+        return os.path.join(directory, SEGMENT_NAME.format(segment)), offset, frameTime
+
+    def read_frame(self, name, timestamp):
+        """
+        Function reads the first archived frame of a camera at or after a time, decoding only its segment
+        :param name: Name of the camera
+        :param timestamp: Time in seconds since the epoch
+        :return: Tuple of the BGR frame and its time
+        """
+        (path, offset, frameTime) = self.locate(name, timestamp)
+        capture = cv2.VideoCapture(path)
+        try:
+            capture.set(cv2.CAP_PROP_POS_FRAMES, offset)
+            (grabbed, frame) = capture.read()
+        finally:
+            capture.release()
+        if not grabbed:
+            # the segment being written only becomes readable once it is closed
+            raise ArchiveError("segment {} is not readable yet".format(os.path.basename(path)))
+        return frame, frameTime
+
+    def stats(self):
+        """
+        Function reports the archive statistics of every camera being recorded
+        :return: Dictionary mapping the camera name to its statistics
+        """
+        with self.lock:
+            cameras = list(self.cameras.items())
+        return {name: camera.stats() for (name, camera) in cameras}
+
+
+def last_frame(directory):
+    # frame number of the last record of an index, None if there is none
+    path = os.path.join(directory, INDEX_FILE)
+    size = os.path.getsize(path) if os.path.exists(path) else 0
+    if size < INDEX_RECORD.itemsize:
+        return None
+    with open(path, "rb") as index:
+        index.seek((size // INDEX_RECORD.itemsize - 1) * INDEX_RECORD.itemsize)
+        return int(np.frombuffer(index.read(INDEX_RECORD.itemsize), dtype=INDEX_RECORD)["frame"][0])
+
+
+def directory_bytes(directory):
+    return sum(entry.stat().st_size for entry in os.scandir(directory) if entry.is_file())
@@ -0,0 +1,24 @@
+# batching.py
+
+"""
+This module contains the stage that groups frames from several cameras into a single inference batch
+"""
+
+
+def collect_batch(slots, batch_size, max_wait):
+    """
+    Function gathers the latest frame from each camera that reports within a short time window
+    :param slots: ingest.FrameSlots the receiving thread stores frames in
+    :param batch_size: Maximum number of cameras in a batch
+    :param max_wait: Maximum seconds to wait for more cameras once the first frame is available
+    :return: Dictionary mapping the client name to its most recent frame
+    """
+    while True:
+        # block until at least one camera has a frame, then give the other
+        # cameras the rest of the window before shipping whatever we have
+        slots.wait()
+        slots.wait(batch_size, max_wait)
+        frames = slots.take(batch_size)
+        # another worker may have taken the frames in the meantime
+        if frames:
+            return frames
@@ -0,0 +1,59 @@
+# benchmarks/archive.py
+
+"""
+Measures what the archive costs: footage of N simulated cameras is handed to the archive at the
+camera frame rate, and the time add() takes on the caller, the frames dropped, the bytes written to
+disk per camera and the CPU time of the encoders are reported.
+
+Run from the monitoring_server directory:
+    python -m benchmarks.archive -n 4 -s 30 --archive-fps 1 -o /tmp/archive
+"""
+
+import argparse
+import resource
+import time
+
+import numpy as np
+
+from archive import Archive
+from benchmarks.transport import synthetic_scene
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("-n", "--cameras", type=int, default=4, help="number of simulated cameras")
+    ap.add_argument("-s", "--seconds", type=float, default=30, help="seconds of footage to archive")
+    ap.add_argument("--fps", type=float, default=15, help="frame rate of the simulated cameras")
+    ap.add_argument("--archive-fps", type=float, default=1, help="frame rate the archive keeps")
+    ap.add_argument("--segment", type=float, default=10, help="seconds per archive segment")
+    ap.add_argument("-o", "--output", default="archive", help="directory the archive is written to")
+    args = vars(ap.parse_args())
+
+    frames = synthetic_scene(100)
+    archive = Archive(args["output"], args["archive_fps"], args["segment"])
+    names = ["cam{}".format(camera) for camera in range(args["cameras"])]
+    timings = []
+    start = time.time()
+    for index in range(int(args["seconds"] * args["fps"])):
+        # replay the footage at the camera frame rate, in simulated time
+        timestamp = start + index / args["fps"]
+        for (camera, name) in enumerate(names):
+            t0 = time.perf_counter()
+            archive.add(name, frames[(index + camera * 7) % len(frames)], timestamp)
+            timings.append(time.perf_counter() - t0)
+        time.sleep(max(0.0, 1.0 / args["fps"] - (time.time() - start - index / args["fps"])))
+    stats = archive.stats()
+    archive.close()
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+
+    timings = np.array(timings) * 1e6
+    print("add(): mean {:.1f} us, p99 {:.1f} us, max {:.1f} us".format(
+        timings.mean(), np.percentile(timings, 99), timings.max()))
+    print("encoder CPU {:.2f}s for {:.0f}s of footage".format(children.ru_utime + children.ru_stime, args["seconds"]))
+    for (name, camera) in stats.items():
+        print("{}: {} frames, {} dropped, {:.1f} KB/s to disk".format(
+            name, camera["archive_frames"], camera["archive_dropped"], camera["archive_bytes_per_second"] / 1024))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+# benchmarks/batching.py
+
+"""
+Compares per-camera and batched MobileNet SSD inference throughput on synthetic frames.
+
+Run from the monitoring_server directory:
+    python -m benchmarks.batching -m caffemodel
+"""
+
+import argparse
+import time
+
+import numpy as np
+import cv2
+
+from detection import detect_batch
+
+
+def synthetic_frames(count, width=400, height=300, seed=0):
+    """
+    Function generates random BGR frames standing in for camera images
+    :param count: Number of frames
+    :param width: Frame width
+    :param height: Frame height
+    :param seed: Seed of the random generator so runs are comparable
+    :return: List of uint8 frames
+    """
+    rng = np.random.default_rng(seed)
+    return [rng.integers(0, 256, (height, width, 3), dtype=np.uint8) for _ in range(count)]
+
+
+def throughput(net, frames, batch_size, iterations):
+    """
+    Function measures how many frames per second the network processes for a given batch size
+    :param net: Network loaded with cv2.dnn
+    :param frames: One frame per simulated camera
+    :param batch_size: Number of frames per forward pass, 1 being the unbatched loop
+    :param iterations: Number of rounds over all cameras
+    :return: Frames per second
+    """
+    # warm up so that lazy allocations in the network are not measured
+    detect_batch(net, frames[:batch_size])
+    start = time.perf_counter()
+    for _ in range(iterations):
+        for i in range(0, len(frames), batch_size):
+            detect_batch(net, frames[i:i + batch_size])
+    return len(frames) * iterations / (time.perf_counter() - start)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("-p", "--prototxt", default="prototxt.txt", help="path to the Caffe deploy prototxt file")
+    ap.add_argument("-m", "--model", default="caffemodel", help="path to the pre-trained Caffe model")
+    ap.add_argument("-n", "--cameras", type=int, nargs="+", default=[1, 4, 8, 16], help="camera counts to simulate")
+    ap.add_argument("-b", "--batch-size", type=int, default=8, help="maximum number of cameras in one batch")
+    ap.add_argument("-i", "--iterations", type=int, default=5, help="rounds over all cameras per measurement")
+    args = vars(ap.parse_args())
+
+    net = cv2.dnn.readNetFromCaffe(args["prototxt"], args["model"])
+    print("{:>8} {:>14} {:>14} {:>8}".format("cameras", "single fps", "batched fps", "speedup"))
+    for cameras in args["cameras"]:
+        frames = synthetic_frames(cameras)
+        single = throughput(net, frames, 1, args["iterations"])
+        batched = throughput(net, frames, min(args["batch_size"], cameras), args["iterations"])
+        print("{:>8} {:>14.1f} {:>14.1f} {:>7.2f}x".format(cameras, single, batched, batched / single))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+# benchmarks/ingest.py
+
+"""
+Load tests the ingest service on localhost: client processes simulate hundreds of cameras, each with
+its own REQ socket sending a JPEG frame and waiting for the acknowledgement, and the sustained frames
+per second received and the acknowledgement round-trip times are reported for the asyncio ROUTER hub
+and, for comparison, the imagezmq REP hub.
+
+Run from the monitoring_server directory:
+    python -m benchmarks.ingest -n 100 300 -P 4 --fps 5
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import threading
+import time
+
+import numpy as np
+import zmq
+import zmq.asyncio
+import cv2
+
+from ingest import FrameSlots
+from router import RouterHub
+from transport import open_hub, recv_frame
+from benchmarks.transport import synthetic_scene
+
+
+def simulate(first, cameras, address, jpeg, fps, seconds, results):
+    """
+    Function runs in a client process: every simulated camera sends frames until the time is up
+    :param first: Index of the first camera of this process
+    :param cameras: Number of cameras simulated by this process
+    :param address: Address of the ingest service
+    :param jpeg: JPEG bytes every camera sends
+    :param fps: Frames per second per camera, 0 to send as fast as the acknowledgements come
+    :param seconds: Duration of the test
+    :param results: Queue the list of round-trip times of this process is put on
+    """
+    async def camera(context, name, rtts, deadline):
+        socket = context.socket(zmq.REQ)
+        socket.connect(address)
+        md = json.dumps({"msg": name}).encode()
+        # spread the cameras over the first frame period
+        await asyncio.sleep(np.random.random() / fps if fps else 0)
+        while time.monotonic() < deadline:
+            start = time.monotonic()
+            await socket.send_multipart([md, jpeg])
+            await socket.recv()
+            rtts.append(time.monotonic() - start)
+            if fps:
+                await asyncio.sleep(max(0.0, start + 1.0 / fps - time.monotonic()))
+        socket.close(linger=0)
+
+    async def run():
+        context = zmq.asyncio.Context()
+        rtts = []
+        deadline = time.monotonic() + seconds
+        await asyncio.gather(*[camera(context, "cam{}".format(first + i), rtts, deadline) for i in range(cameras)])
+        context.term()
+        return rtts
+
+    results.put(asyncio.run(run()))
+
+
+def serve_router(port, slots, stop):
+    hub = RouterHub(open_port="tcp://*:{}".format(port), hwm=2)
+
+    async def run():
+        task = asyncio.ensure_future(hub.serve(lambda md, frame: slots.put(md["msg"], frame)))
+        while not stop.is_set():
+            await asyncio.sleep(0.1)
+        task.cancel()
+
+    asyncio.run(run())
+    hub.close()
+
+
+def serve_rep(port, slots, stop):
+    hub = open_hub("reqrep", port=port)
+    while not stop.is_set():
+        if hub.zmq_socket.poll(100):
+            (md, frame) = recv_frame(hub.zmq_socket)
+            hub.send_reply(b'OK')
+            slots.put(md["msg"], frame)
+    hub.close()
+
+
+def load_test(transport, cameras, processes, jpeg, fps, seconds, port):
+    """
+    Function runs one load test
+    :return: Tuple of the frames per second received and the round-trip times in seconds
+    """
+    (slots, stop) = (FrameSlots(), threading.Event())
+    server = threading.Thread(target=serve_router if transport == "router" else serve_rep, args=(port, slots, stop))
+    server.start()
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    shares = [cameras // processes + (1 if i < cameras % processes else 0) for i in range(processes)]
+    clients = [context.Process(target=simulate, args=(sum(shares[:i]), share, "tcp://127.0.0.1:{}".format(port),
+                                                       jpeg, fps, seconds, results))
+               for (i, share) in enumerate(shares) if share]
+    for client in clients:
+        client.start()
+    rtts = [rtt for _ in clients for rtt in results.get()]
+    for client in clients:
+        client.join()
+    stop.set()
+    server.join()
+    received = sum(slots.stats()[name]["received"] for name in slots.stats())
+    return received / seconds, np.array(rtts)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("-n", "--cameras", type=int, nargs="+", default=[100, 300], help="numbers of simulated cameras")
+    ap.add_argument("-P", "--processes", type=int, default=4, help="client processes the cameras are spread over")
+    ap.add_argument("--fps", type=float, default=5, help="frames per second per camera, 0 for as fast as possible")
+    ap.add_argument("-s", "--seconds", type=float, default=10, help="duration of every test")
+    ap.add_argument("-q", "--jpeg-quality", type=int, default=70, help="quality of the JPEG frame sent")
+    ap.add_argument("-t", "--transport", nargs="+", choices=["router", "reqrep"], default=["router", "reqrep"],
+                    help="ingest services to test")
+    ap.add_argument("--port", type=int, default=5599, help="port of the ingest service")
+    args = vars(ap.parse_args())
+
+    jpeg = cv2.imencode(".jpg", synthetic_scene(1)[0], [cv2.IMWRITE_JPEG_QUALITY, args["jpeg_quality"]])[1].tobytes()
+    print("{} byte frames, {} client processes".format(len(jpeg), args["processes"]))
+    print("{:>9} {:>8} {:>12} {:>10} {:>10}".format("transport", "cameras", "frames/s", "rtt p50", "rtt p99"))
+    for cameras in args["cameras"]:
+        for transport in args["transport"]:
+            (fps, rtts) = load_test(transport, cameras, args["processes"], jpeg, args["fps"], args["seconds"],
+                                    args["port"])
+            print("{:>9} {:>8} {:>12.1f} {:>8.1f}ms {:>8.1f}ms".format(
+                transport, cameras, fps, np.percentile(rtts, 50) * 1000, np.percentile(rtts, 99) * 1000))
+
+
+if __name__ == "__main__":
+    main()
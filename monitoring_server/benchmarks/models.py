@@ -0,0 +1,96 @@
+# benchmarks/models.py
+
+"""
+Compares detection models on the same recorded clips: frames per second, and how often the object counts
+of every frame agree with the first model listed, so that the cheapest model that is accurate enough
+can be picked. Models are given as engine:model[:prototxt]; with -Q an int8 copy of every ONNX model
+is quantized with onnxruntime and compared as well.
+
+Run from the monitoring_server directory:
+    python -m benchmarks.models -f a.mp4 b.mp4 -M caffe:caffemodel:prototxt.txt onnx:ssd.onnx -Q
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+import imutils
+
+from detection import detect_batch
+from detectors import ENGINES, BACKENDS, TARGETS, load_net, quantize
+from benchmarks.tracking import count_objects
+from benchmarks.transport import synthetic_scene, video_frames
+
+
+def parse_model(spec):
+    """
+    Function splits a model given on the command line
+    :param spec: engine:model[:prototxt]
+    :return: Dictionary of the engine, model and prototxt
+    """
+    (engine, model, *prototxt) = spec.split(":")
+    if engine not in ENGINES:
+        raise argparse.ArgumentTypeError("unknown engine {}".format(engine))
+    return {"engine": engine, "model": model, "prototxt": prototxt[0] if prototxt else "prototxt.txt"}
+
+
+def evaluate(net, frames, batch_size, confidence):
+    """
+    Function runs a model over the frames in batches
+    :param net: Network returned by load_net
+    :param frames: Frames to detect objects in
+    :param batch_size: Frames per forward pass
+    :param confidence: Minimum detection confidence
+    :return: Tuple of the frames per second and the per-frame counts
+    """
+    # one warm up pass so that lazy initialisation is not measured
+    detect_batch(net, frames[:batch_size])
+    counts = []
+    start = time.perf_counter()
+    for i in range(0, len(frames), batch_size):
+        for detections in detect_batch(net, frames[i:i + batch_size]):
+            counts.append(count_objects(detections, confidence))
+    return len(frames) / (time.perf_counter() - start), counts
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("-M", "--models", type=parse_model, nargs="+", default=[parse_model("caffe:caffemodel")],
+                    help="models to compare as engine:model[:prototxt], the first one being the reference")
+    ap.add_argument("-Q", "--quantize", action="store_true", help="also compare an int8 copy of every ONNX model")
+    ap.add_argument("-f", "--video-file", nargs="*", default=[], help="recorded clips, synthetic frames when missing")
+    ap.add_argument("-n", "--frames", type=int, default=200, help="maximum number of frames to use per clip")
+    ap.add_argument("-b", "--batch-size", type=int, default=1, help="frames per forward pass")
+    ap.add_argument("-c", "--confidence", type=float, default=0.8, help="minimum probability to filter weak detections")
+    ap.add_argument("--backend", choices=sorted(BACKENDS), default="default", help="cv2.dnn backend")
+    ap.add_argument("--target", choices=sorted(TARGETS), default="cpu", help="cv2.dnn target device")
+    args = vars(ap.parse_args())
+
+    frames = [frame for path in args["video_file"] for frame in video_frames(path, args["frames"])]
+    frames = [imutils.resize(frame, width=400) for frame in frames or synthetic_scene(args["frames"])]
+
+    models = []
+    scratch = tempfile.mkdtemp()
+    for model in args["models"]:
+        models.append(model)
+        if args["quantize"] and model["engine"] != "caffe":
+            quantized = os.path.join(scratch, "int8-" + os.path.basename(model["model"]))
+            quantize(model["model"], quantized)
+            models.append(dict(model, engine="onnxruntime", model=quantized))
+
+    print("{:>12} {:>30} {:>8} {:>13} {:>15}".format("engine", "model", "fps", "counts agree", "mean abs error"))
+    reference = None
+    for model in models:
+        net = load_net(backend=args["backend"], target=args["target"], **model)
+        (fps, counts) = evaluate(net, frames, args["batch_size"], args["confidence"])
+        reference = counts if reference is None else reference
+        agree = np.mean([c == r for (c, r) in zip(counts, reference)]) * 100
+        error = np.mean(np.abs(np.array(counts) - np.array(reference)))
+        print("{:>12} {:>30} {:>8.1f} {:>12.1f}% {:>15.3f}".format(
+            model["engine"], os.path.basename(model["model"])[-30:], fps, agree, error))
+
+
+if __name__ == "__main__":
+    main()
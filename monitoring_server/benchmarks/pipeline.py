@@ -0,0 +1,164 @@
+# benchmarks/pipeline.py
+
+"""
+Replays recorded or synthetic footage as N simulated cameras through the same ingest, inference,
+annotation, montage and encode stages as recognition(), without any network or camera, and writes the
+throughput, per-stage latency percentiles and memory use to a JSON file so that runs can be compared
+between commits.
+
+Run from the monitoring_server directory, passing any server option after the harness options:
+    python -m benchmarks.pipeline -n 8 -f a.mp4 b.mp4 -o results.json -- -m caffemodel -b 4
+"""
+
+import argparse
+import json
+import resource
+import subprocess
+import threading
+import time
+
+import numpy as np
+import cv2
+
+import app as server
+from batching import collect_batch
+from transport import JpegFrame
+from benchmarks.transport import synthetic_scene, video_frames
+
+STAGES = ["ingest", "prepare", "infer", "annotate", "compose", "encode", "total"]
+
+
+def camera_footage(cameras, files, count):
+    """
+    Function gives every simulated camera its own footage, cycling through the video files and starting
+    each camera at a different offset so that cameras sharing a file do not show identical frames
+    :param cameras: Number of simulated cameras
+    :param files: Video files, synthetic frames are used when empty
+    :param count: Frames to load per file
+    :return: List with one list of frames per camera
+    """
+    sources = [video_frames(path, count) for path in files] or [synthetic_scene(count)]
+    footage = []
+    for camera in range(cameras):
+        frames = sources[camera % len(sources)]
+        offset = (camera * 7) % len(frames)
+        footage.append(frames[offset:] + frames[:offset])
+    return footage
+
+
+def rss_kb():
+    # resident set size of the process right now
+    with open("/proc/self/statm") as statm:
+        return int(statm.read().split()[1]) * resource.getpagesize() // 1024
+
+
+def percentiles(samples):
+    samples = np.array(samples) * 1000
+    if not len(samples):
+        return {}
+    return {"mean_ms": float(samples.mean()),
+            "p50_ms": float(np.percentile(samples, 50)),
+            "p95_ms": float(np.percentile(samples, 95)),
+            "p99_ms": float(np.percentile(samples, 99)),
+            "count": int(len(samples))}
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def replay(args, serverArgs):
+    """
+    Function feeds the footage into the server stages round after round and times every stage
+    :param args: Harness options
+    :param serverArgs: Server options, as parsed by app.build_parser
+    :return: Dictionary of the results
+    """
+    footage = camera_footage(args["cameras"], args["video_file"], args["frames"])
+    names = ["cam{}".format(camera) for camera in range(args["cameras"])]
+    quality = args["jpeg_quality"]
+    detect = server.load_detector(serverArgs)
+    lock = threading.Lock()
+    samples = {stage: [] for stage in STAGES}
+    (encodedSeq, processed) = (0, 0)
+    rssStart = rss_kb()
+    start = time.perf_counter()
+
+    for index in range(args["rounds"]):
+        roundStart = time.perf_counter()
+        # every camera delivers a frame, raw or JPEG encoded as a camera
+        # configured with --jpeg-quality would send it
+        for (name, frames) in zip(names, footage):
+            frame = frames[index % len(frames)]
+            if quality:
+                frame = JpegFrame(cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, quality])[1].tobytes())
+            server.liveness.touch(name)
+            server.slots.put(name, frame)
+        while server.slots.available():
+            t0 = time.perf_counter()
+            batch = collect_batch(server.slots, serverArgs["batch_size"], 0)
+            t1 = time.perf_counter()
+            frames = server.prepare(batch)
+            t2 = time.perf_counter()
+            results = server.infer(detect, frames, serverArgs)
+            t3 = time.perf_counter()
+            server.annotate(frames, results, serverArgs)
+            t4 = time.perf_counter()
+            server.compose(frames, lock, serverArgs)
+            t5 = time.perf_counter()
+            # encode as the first viewer of the montage would
+            (encodedSeq, _) = server.montageFeed.wait(encodedSeq, timeout=0)
+            t6 = time.perf_counter()
+            server.slots.done(batch)
+            processed += len(frames)
+            for (stage, elapsed) in zip(STAGES, (t1 - t0, t2 - t1, t3 - t2, t4 - t3, t5 - t4, t6 - t5, t6 - t0)):
+                samples[stage].append(elapsed)
+        if args["fps"]:
+            # replay at the camera frame rate instead of as fast as possible
+            time.sleep(max(0.0, roundStart + 1.0 / args["fps"] - time.perf_counter()))
+
+    elapsed = time.perf_counter() - start
+    return {"commit": git_commit(),
+            "cameras": args["cameras"],
+            "rounds": args["rounds"],
+            "jpeg_quality": quality,
+            "server_options": dict(serverArgs),
+            "frames": processed,
+            "seconds": elapsed,
+            "fps": processed / elapsed,
+            "stages": {stage: percentiles(values) for (stage, values) in samples.items()},
+            "memory": {"rss_start_kb": rssStart, "rss_end_kb": rss_kb(),
+                       "rss_peak_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}}
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("-n", "--cameras", type=int, default=4, help="number of simulated cameras")
+    ap.add_argument("-f", "--video-file", nargs="*", default=[], help="footage to replay, synthetic frames when missing")
+    ap.add_argument("-N", "--frames", type=int, default=100, help="frames to load per video file")
+    ap.add_argument("-r", "--rounds", type=int, default=50, help="frames sent by every camera")
+    ap.add_argument("-q", "--jpeg-quality", type=int, default=0, help="simulate cameras sending JPEG, 0 for raw frames")
+    ap.add_argument("--fps", type=float, default=0, help="camera frame rate, 0 to replay as fast as possible")
+    ap.add_argument("-o", "--output", default="pipeline.json", help="file the JSON results are written to")
+    (args, rest) = ap.parse_known_args()
+    args = vars(args)
+    serverArgs = vars(server.build_parser().parse_args([option for option in rest if option != "--"]))
+    server.setup(serverArgs)
+
+    results = replay(args, serverArgs)
+    with open(args["output"], "w") as output:
+        json.dump(results, output, indent=2)
+
+    print("{} cameras, {} frames in {:.1f}s: {:.1f} fps, peak RSS {} MB".format(
+        results["cameras"], results["frames"], results["seconds"], results["fps"],
+        results["memory"]["rss_peak_kb"] // 1024))
+    print("{:>9} {:>9} {:>9} {:>9}".format("stage", "p50 ms", "p95 ms", "p99 ms"))
+    for (stage, stats) in results["stages"].items():
+        print("{:>9} {:>9.2f} {:>9.2f} {:>9.2f}".format(stage, stats["p50_ms"], stats["p95_ms"], stats["p99_ms"]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+# benchmarks/pool.py
+
+"""
+Measures detector throughput against the number of worker processes of the inference pool.
+
+Run from the monitoring_server directory:
+    python -m benchmarks.pool -m caffemodel -P 1 2 4 8
+"""
+
+import argparse
+import os
+import threading
+import time
+
+import cv2
+
+from detection import detect_batch
+from pool import InferencePool
+from benchmarks.batching import synthetic_frames
+
+
+def drive(detect, cameras, seconds, threads):
+    """
+    Function keeps the detector busy from several threads, each owning a share of the cameras
+    :param detect: Callable taking a dictionary of camera frames
+    :param cameras: Dictionary mapping the camera name to its frame
+    :param seconds: Duration of the measurement
+    :param threads: Number of submitting threads
+    :return: Frames per second
+    """
+    names = list(cameras)
+    counts = [0] * threads
+    deadline = time.monotonic() + seconds
+
+    def submit(index):
+        share = {name: cameras[name] for name in names[index::threads]}
+        while share and time.monotonic() < deadline:
+            detect(share)
+            counts[index] += len(share)
+
+    workers = [threading.Thread(target=submit, args=(i,)) for i in range(threads)]
+    start = time.monotonic()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return sum(counts) / (time.monotonic() - start)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("-p", "--prototxt", default="prototxt.txt", help="path to the Caffe deploy prototxt file")
+    ap.add_argument("-m", "--model", default="caffemodel", help="path to the pre-trained Caffe model")
+    ap.add_argument("-P", "--processes", type=int, nargs="+", default=[1, 2, 4, os.cpu_count()],
+                    help="worker process counts to compare")
+    ap.add_argument("-n", "--cameras", type=int, default=16, help="number of simulated cameras")
+    ap.add_argument("-s", "--seconds", type=float, default=10, help="duration of every measurement")
+    args = vars(ap.parse_args())
+
+    cameras = dict(("cam{}".format(i), frame) for (i, frame) in enumerate(synthetic_frames(args["cameras"])))
+    net = cv2.dnn.readNetFromCaffe(args["prototxt"], args["model"])
+    baseline = drive(lambda frames: detect_batch(net, list(frames.values())), cameras, args["seconds"], 1)
+    print("{:>10} {:>10} {:>8}".format("processes", "fps", "speedup"))
+    print("{:>10} {:>10.1f} {:>8}".format("in-thread", baseline, "1.00x"))
+    for processes in sorted(set(args["processes"])):
+        pool = InferencePool(processes, {"prototxt": args["prototxt"], "model": args["model"]})
+        # one warm up round so that model loading is not measured
+        pool.detect(cameras)
+        fps = drive(pool.detect, cameras, args["seconds"], processes)
+        pool.close()
+        print("{:>10} {:>10.1f} {:>7.2f}x".format(processes, fps, fps / baseline))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+# benchmarks/postprocess.py
+
+"""
+Compares the per-row Python loop that used to post-process detections with the vectorized filter,
+on synthetic detection tensors.
+
+Run from the monitoring_server directory:
+    python -m benchmarks.postprocess -r 100 300 1000
+"""
+
+import argparse
+import timeit
+
+import numpy as np
+
+from detection import class_mask, filter_detections
+
+CLASSES = ["background", "bottle", "cat", "chair", "dog", "person", "pottedplant", "sofa", "tvmonitor"]
+CONSIDER = set(["dog", "person"])
+CONSIDER_MASK = class_mask(CLASSES, CONSIDER)
+
+
+def synthetic_detections(rows, seed=0):
+    """
+    Function generates a detection tensor like the one of the DetectionOutput layer
+    :param rows: Number of candidate rows
+    :param seed: Seed of the random generator so runs are comparable
+    :return: (rows, 7) float32 array
+    """
+    rng = np.random.default_rng(seed)
+    detections = np.zeros((rows, 7), dtype=np.float32)
+    detections[:, 1] = rng.integers(0, 21, rows)
+    detections[:, 2] = rng.random(rows)
+    corners = np.sort(rng.random((rows, 2, 2)), axis=1)
+    detections[:, 3:7] = corners.transpose(0, 2, 1).reshape(rows, 4)[:, [0, 2, 1, 3]]
+    return detections
+
+
+def loop(detections, confidence, w, h):
+    # the post-processing recognition() used before, without the drawing
+    objCount = {obj: 0 for obj in CONSIDER}
+    boxes = []
+    for i in np.arange(0, detections.shape[0]):
+        if detections[i, 2] > confidence:
+            idx = int(detections[i, 1])
+            try:
+                if CLASSES[idx] in CONSIDER:
+                    objCount[CLASSES[idx]] += 1
+                    box = detections[i, 3:7] * np.array([w, h, w, h])
+                    boxes.append(box.astype("int"))
+            except:
+                pass
+    return objCount, boxes
+
+
+def vectorized(detections, confidence, w, h, nms_threshold=0.0):
+    (boxes, classIds) = filter_detections(detections, confidence, CONSIDER_MASK, (w, h), nms_threshold)
+    counts = np.bincount(classIds, minlength=len(CLASSES))
+    return {obj: int(counts[CLASSES.index(obj)]) for obj in CONSIDER}, boxes
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("-r", "--rows", type=int, nargs="+", default=[100, 300, 1000], help="candidate rows per tensor")
+    ap.add_argument("-c", "--confidence", type=float, default=0.2, help="minimum confidence")
+    ap.add_argument("-i", "--iterations", type=int, default=200, help="repetitions per measurement")
+    args = vars(ap.parse_args())
+
+    (w, h) = (400, 300)
+    print("{:>6} {:>10} {:>12} {:>12} {:>8}".format("rows", "loop us", "vector us", "+nms us", "speedup"))
+    for rows in args["rows"]:
+        detections = synthetic_detections(rows)
+        assert loop(detections, args["confidence"], w, h)[0] == vectorized(detections, args["confidence"], w, h)[0]
+        timings = [timeit.timeit(lambda: fn(detections, args["confidence"], w, h, *extra), number=args["iterations"])
+                   * 1e6 / args["iterations"]
+                   for (fn, extra) in ((loop, ()), (vectorized, ()), (vectorized, (0.45,)))]
+        print("{:>6} {:>10.1f} {:>12.1f} {:>12.1f} {:>7.1f}x".format(rows, *timings, timings[0] / timings[1]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+# benchmarks/tracking.py
+
+"""
+Compares detecting every frame against detecting every N frames and tracking in between, on recorded
+footage: detector calls saved and how often the object counts agree with full detection.
+
+Run from the monitoring_server directory:
+    python -m benchmarks.tracking -m caffemodel -f recording.mp4 -d 2 4 8
+"""
+
+import argparse
+
+import numpy as np
+import imutils
+import cv2
+
+from detection import detect_batch, class_mask, filter_detections
+from tracking import CameraTracker
+from benchmarks.transport import synthetic_scene, video_frames
+
+# class labels of the model and the ones counted, as in app.py
+CLASSES = ["background", "bottle", "cat", "chair", "dog", "person", "pottedplant", "sofa", "tvmonitor"]
+CONSIDER = ["dog", "person"]
+CONSIDER_MASK = class_mask(CLASSES, CONSIDER)
+
+
+def count_objects(detections, confidence):
+    """
+    Function counts the detections of every considered class above the confidence threshold
+    :param detections: (N, 7) detections of one frame
+    :param confidence: Minimum confidence
+    :return: Tuple of counts in the order of CONSIDER
+    """
+    (_, classIds) = filter_detections(detections, confidence, CONSIDER_MASK, (1, 1))
+    counts = np.bincount(classIds, minlength=len(CLASSES))
+    return tuple(int(counts[CLASSES.index(obj)]) for obj in CONSIDER)
+
+
+def run(net, frames, interval, confidence, min_confidence):
+    """
+    Function runs the detector every interval frames and tracks the detections in between
+    :param net: Network loaded with cv2.dnn
+    :param frames: Frames of one camera
+    :param interval: Detector interval, 1 to detect every frame
+    :param confidence: Minimum detection confidence
+    :param min_confidence: Fraction of tracked points below which the detector runs straight away
+    :return: Tuple of the per-frame counts and the number of detector calls
+    """
+    tracker = CameraTracker()
+    counts = []
+    for frame in frames:
+        if tracker.due(interval, min_confidence):
+            detections = detect_batch(net, [frame])[0]
+            tracker.reset(frame, detections[detections[:, 2] > confidence])
+        else:
+            detections = tracker.track(frame)
+        counts.append(count_objects(detections, confidence))
+    return counts, tracker.detections
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("-p", "--prototxt", default="prototxt.txt", help="path to the Caffe deploy prototxt file")
+    ap.add_argument("-m", "--model", default="caffemodel", help="path to the pre-trained Caffe model")
+    ap.add_argument("-f", "--video-file", help="recorded footage, synthetic frames are used when missing")
+    ap.add_argument("-n", "--frames", type=int, default=300, help="maximum number of frames to use")
+    ap.add_argument("-d", "--detect-every", type=int, nargs="+", default=[2, 4, 8], help="detector intervals to compare")
+    ap.add_argument("-c", "--confidence", type=float, default=0.8, help="minimum probability to filter weak detections")
+    ap.add_argument("--track-confidence", type=float, default=0.5, help="re-detect below this fraction of tracked points")
+    args = vars(ap.parse_args())
+
+    net = cv2.dnn.readNetFromCaffe(args["prototxt"], args["model"])
+    if args["video_file"]:
+        frames = video_frames(args["video_file"], args["frames"])
+    else:
+        frames = synthetic_scene(args["frames"])
+    frames = [imutils.resize(frame, width=400) for frame in frames]
+
+    (reference, calls) = run(net, frames, 1, args["confidence"], args["track_confidence"])
+    print("{:>9} {:>15} {:>12} {:>15} {:>15}".format("interval", "detector calls", "calls saved", "counts agree", "mean abs error"))
+    print("{:>9} {:>15} {:>11.1f}% {:>14.1f}% {:>15.3f}".format(1, calls, 0.0, 100.0, 0.0))
+    for interval in args["detect_every"]:
+        (counts, calls) = run(net, frames, interval, args["confidence"], args["track_confidence"])
+        agree = np.mean([c == r for (c, r) in zip(counts, reference)]) * 100
+        error = np.mean(np.abs(np.array(counts) - np.array(reference)))
+        saved = (1 - calls / len(frames)) * 100
+        print("{:>9} {:>15} {:>11.1f}% {:>14.1f}% {:>15.3f}".format(interval, calls, saved, agree, error))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+# benchmarks/transport.py
+
+"""
+Compares raw and JPEG frame transport: bytes per frame, client encode cost and server decode cost.
+
+Run from the monitoring_server directory:
+    python -m benchmarks.transport -q 50 70 90
+    python -m benchmarks.transport -f recording.mp4
+"""
+
+import argparse
+import time
+
+import numpy as np
+import cv2
+
+from transport import JpegFrame
+
+
+def synthetic_scene(count, width=640, height=480, seed=0):
+    """
+    Function generates frames resembling a room: a smooth background, a few furniture blocks, a moving
+    figure and sensor noise, so that JPEG compression behaves as it would on camera footage
+    :param count: Number of frames
+    :param width: Frame width
+    :param height: Frame height
+    :param seed: Seed of the random generator so runs are comparable
+    :return: List of uint8 BGR frames
+    """
+    rng = np.random.default_rng(seed)
+    (ys, xs) = np.mgrid[0:height, 0:width]
+    background = np.dstack([(xs * 120 // width + 60), (ys * 100 // height + 80), np.full_like(xs, 110)]).astype(np.uint8)
+    cv2.rectangle(background, (40, height // 2), (width // 3, height - 40), (40, 70, 120), -1)
+    cv2.rectangle(background, (width // 2, 60), (width - 60, height // 3), (150, 150, 160), -1)
+    frames = []
+    for i in range(count):
+        frame = background.copy()
+        x = 100 + (i * 7) % (width - 200)
+        cv2.ellipse(frame, (x, height // 2), (40, 110), 0, 0, 360, (30, 30, 200), -1)
+        noise = rng.integers(-6, 7, frame.shape, dtype=np.int16)
+        frames.append(np.clip(frame.astype(np.int16) + noise, 0, 255).astype(np.uint8))
+    return frames
+
+
+def video_frames(path, count):
+    """
+    Function reads frames from a recorded video
+    :param path: Path of the video file
+    :param count: Maximum number of frames to read
+    :return: List of BGR frames
+    """
+    stream = cv2.VideoCapture(path)
+    frames = []
+    while len(frames) < count:
+        (grabbed, frame) = stream.read()
+        if not grabbed:
+            break
+        frames.append(frame)
+    stream.release()
+    return frames
+
+
+def measure(frames, quality):
+    """
+    Function sends the frames through a serialisation round trip without the network
+    :param frames: BGR frames
+    :param quality: JPEG quality, 0 for raw frames
+    :return: Tuple of mean bytes per frame, mean client encode ms and mean server decode ms
+    """
+    (size, encode, decode) = (0, 0.0, 0.0)
+    for frame in frames:
+        start = time.perf_counter()
+        if quality:
+            (flag, buffer) = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, quality])
+            payload = buffer.tobytes()
+        else:
+            payload = np.ascontiguousarray(frame).tobytes()
+        encode += time.perf_counter() - start
+        size += len(payload)
+        start = time.perf_counter()
+        if quality:
+            JpegFrame(payload).decode()
+        else:
+            np.frombuffer(payload, dtype=np.uint8).reshape(frame.shape)
+        decode += time.perf_counter() - start
+    count = len(frames)
+    return size / count, encode * 1000 / count, decode * 1000 / count
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("-f", "--video-file", help="recorded footage to use instead of synthetic frames")
+    ap.add_argument("-q", "--quality", type=int, nargs="+", default=[50, 70, 90], help="JPEG qualities to compare")
+    ap.add_argument("-n", "--frames", type=int, default=100, help="number of frames to measure")
+    args = vars(ap.parse_args())
+
+    if args["video_file"]:
+        frames = video_frames(args["video_file"], args["frames"])
+    else:
+        frames = synthetic_scene(args["frames"])
+    print("{:>8} {:>12} {:>12} {:>12}".format("mode", "KB/frame", "encode ms", "decode ms"))
+    for quality in [0] + args["quality"]:
+        (size, encode, decode) = measure(frames, quality)
+        mode = "jpeg{}".format(quality) if quality else "raw"
+        print("{:>8} {:>12.1f} {:>12.2f} {:>12.2f}".format(mode, size / 1024, encode, decode))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+# broadcast.py
+
+"""
+This module contains the hub that hands each new frame to every connected viewer as a single JPEG encoding
+"""
+
+import threading
+import time
+from contextlib import nullcontext
+
+import cv2
+
+
+class FrameBroadcaster:
+    """
+    Holds the latest frame together with a sequence number. Viewers block on a condition variable until
+    the sequence number moves past the last one they sent, and the frame is encoded at most once no
+    matter how many viewers ask for it.
+    """
+
+    def __init__(self, quality=95, timer=None, latency=None):
+        self.quality = quality
+        # called with the seconds every encoding took, and with the capture
+        # time of every frame once, when the first viewer is handed it
+        self.timer = timer
+        self.latency = latency
+        self.ready = threading.Condition()
+        self.encoding = threading.Lock()
+        self.frame = None
+        self.frameLock = None
+        self.captured = None
+        self.seq = 0
+        self.jpeg = None
+        self.encoded = None
+        self.encoded_seq = 0
+        self.encodedCaptured = None
+        self.timed_seq = 0
+        self.viewers = 0
+
+    def publish(self, frame, lock=None, captured=None):
+        """
+        Function replaces the frame being broadcast and wakes the waiting viewers
+        :param frame: New BGR frame
+        :param lock: Lock to hold while encoding, for frames that are painted in place
+        :param captured: Time the camera captured the frame, on the clock of the server, if known, or
+            anything else the latency callback takes
+        """
+        with self.ready:
+            self.frame = frame
+            self.frameLock = lock
+            self.captured = captured
+            self.seq += 1
+            self.ready.notify_all()
+
+    def publish_jpeg(self, jpeg, captured=None):
+        """
+        Function replaces the frame being broadcast with a frame that is already encoded
+        :param jpeg: JPEG bytes of the new frame
+        :param captured: Time the camera captured the frame, on the clock of the server, if known
+        """
+        # the encoding is in place before the viewers can see the new
+        # sequence number, so none of them tries to encode it
+        with self.encoding:
+            with self.ready:
+                self.frame = None
+                self.seq += 1
+                seq = self.seq
+            self.jpeg = jpeg
+            self.encoded = b'--frame\r\nContent-Type: image/jpeg\r\n\r\n' + jpeg + b'\r\n'
+            self.encoded_seq = seq
+            self.encodedCaptured = captured
+        with self.ready:
+            self.ready.notify_all()
+
+    def wait(self, seq, timeout=None):
+        """
+        Function blocks until a frame newer than the given sequence number is available
+        :param seq: Sequence number of the last frame the viewer received, 0 if none
+        :param timeout: Maximum seconds to wait, None to wait forever
+        :return: Tuple of the sequence number and the multipart chunk of the frame, or (seq, None) on timeout
+        """
+        with self.ready:
+            if not self.ready.wait_for(lambda: self.seq > seq, timeout):
+                return seq, None
+            (frame, lock, seq, captured) = (self.frame, self.frameLock, self.seq, self.captured)
+        return self.encode(frame, seq, lock, captured)
+
+    def encode(self, frame, seq, lock=None, captured=None):
+        """
+        Function encodes a frame unless it or a newer one has already been encoded
+        :param frame: BGR frame
+        :param seq: Sequence number of the frame
+        :param lock: Lock keeping the frame from being painted while it is encoded
+        :param captured: Time the camera captured the frame, if known
+        :return: Tuple of the sequence number and the multipart chunk actually returned
+        """
+        with self.encoding:
+            if self.encoded_seq < seq:
+                with lock or nullcontext():
+                    start = time.perf_counter()
+                    (flag, encodedImage) = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+                if self.timer is not None:
+                    self.timer(time.perf_counter() - start)
+                if flag:
+                    # build the whole multipart chunk once so that every viewer
+                    # sends the very same bytes object
+                    self.jpeg = encodedImage.tobytes()
+                    self.encoded = (b'--frame\r\n'
+                                    b'Content-Type: image/jpeg\r\n\r\n' + self.jpeg + b'\r\n')
+                    self.encoded_seq = seq
+                    self.encodedCaptured = captured
+            # whether it was encoded here or arrived encoded, a frame is
+            # timed once, when the first viewer is handed it
+            if self.timed_seq < self.encoded_seq:
+                self.timed_seq = self.encoded_seq
+                if self.latency is not None and self.encodedCaptured is not None:
+                    self.latency(self.encodedCaptured)
+            return self.encoded_seq, self.encoded
+
+    def snapshot(self):
+        """
+        Function returns the latest frame as a JPEG image
+        :return: JPEG bytes, None if no frame has been published yet
+        """
+        with self.ready:
+            (frame, lock, seq, captured) = (self.frame, self.frameLock, self.seq, self.captured)
+        if seq == 0:
+            return None
+        self.encode(frame, seq, lock, captured)
+        return self.jpeg
+
+    def stream(self):
+        """
+        Function yields the multipart chunk of every new frame, sleeping while no new frame is published
+        """
+        seq = 0
+        with self.ready:
+            self.viewers += 1
+        try:
+            while True:
+                (seq, chunk) = self.wait(seq)
+                if chunk is not None:
+                    yield chunk
+        finally:
+            # the generator is closed once the viewer disconnects
+            with self.ready:
+                self.viewers -= 1
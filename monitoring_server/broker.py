@@ -0,0 +1,223 @@
+# broker.py
+
+"""
+This module contains the broker mode that spreads the cameras over several recognition worker processes
+or hosts. The broker receives the frames of every camera and forwards them to the worker the camera is
+assigned to, and the workers send their annotated frames and detections back to the aggregator that
+serves the viewers.
+"""
+
+import json
+import threading
+import time
+
+import zmq
+
+from transport import parse_frame, acknowledgement
+
+# ports the workers fetch frames from and send their results to
+BACKEND_PORT = 5556
+RESULTS_PORT = 5557
+# seconds between the heartbeats of a worker, and after which a silent
+# worker is considered gone and its cameras assigned again
+HEARTBEAT_SECONDS = 1.0
+WORKER_TIMEOUT = 3.0
+READY = b"READY"
+HEARTBEAT = b"HEARTBEAT"
+
+
+class Broker:
+    """
+    Receives the frames of the cameras on a ROUTER socket, acknowledging each straight away, and hands
+    them to the workers connected to a second ROUTER socket. A camera sticks to the worker it was first
+    given, the one with the fewest cameras at the time, so that its tracker and motion state stay on one
+    worker; it only moves when its worker stops sending heartbeats.
+    """
+
+    def __init__(self, frontend_port=5555, backend_port=BACKEND_PORT, hwm=2, touch=None):
+        self.context = zmq.Context()
+        self.frontend = self.context.socket(zmq.ROUTER)
+        self.frontend.setsockopt(zmq.RCVHWM, hwm)
+        self.frontend.bind("tcp://*:{}".format(frontend_port))
+        self.backend = self.context.socket(zmq.ROUTER)
+        # frames a worker cannot take in time are dropped rather than queued,
+        # and reported instead of silently discarded
+        self.backend.setsockopt(zmq.SNDHWM, hwm)
+        self.backend.setsockopt(zmq.ROUTER_MANDATORY, 1)
+        self.backend.bind("tcp://*:{}".format(backend_port))
+        self.workers = {}
+        # guards the assignment and the counters, which web threads read and
+        # the eviction of a camera clears
+        self.lock = threading.Lock()
+        self.assignment = {}
+        self.forwarded = {}
+        self.undelivered = {}
+        # called with the name of the camera of every message, frame or
+        # heartbeat, which only the broker sees
+        self.touch = touch
+
+    def run(self):
+        # runs on its own thread, forwarding frames forever
+        poller = zmq.Poller()
+        poller.register(self.frontend, zmq.POLLIN)
+        poller.register(self.backend, zmq.POLLIN)
+        while True:
+            events = dict(poller.poll(HEARTBEAT_SECONDS * 1000))
+            if self.backend in events:
+                self.register(self.backend.recv_multipart())
+            if self.frontend in events:
+                self.forward(self.frontend.recv_multipart(copy=False))
+            self.expire()
+
+    def register(self, parts):
+        # every message of a worker, ready or heartbeat, keeps it alive
+        (worker, _) = parts
+        if worker not in self.workers:
+            print("[INFO] worker {} joined".format(worker.hex()))
+        self.workers[worker] = time.monotonic()
+
+    def expire(self):
+        now = time.monotonic()
+        for worker in [worker for (worker, seen) in self.workers.items() if now - seen > WORKER_TIMEOUT]:
+            print("[INFO] worker {} left".format(worker.hex()))
+            del self.workers[worker]
+            with self.lock:
+                for name in [name for (name, assigned) in self.assignment.items() if assigned == worker]:
+                    del self.assignment[name]
+
+    def worker_for(self, name):
+        """
+        Function returns the worker a camera is assigned to, assigning new cameras to the least busy worker
+        :param name: Name of the camera
+        :return: Identity of the worker, None if no worker is connected
+        """
+        with self.lock:
+            if name not in self.assignment:
+                if not self.workers:
+                    return None
+                load = {worker: 0 for worker in self.workers}
+                for assigned in self.assignment.values():
+                    load[assigned] += 1
+                self.assignment[name] = min(load, key=load.get)
+            return self.assignment[name]
+
+    def forget(self, name):
+        """
+        Function drops the assignment and the counters of a camera that went silent, so that it no longer
+        counts towards the load of its worker
+        :param name: Name of the camera
+        """
+        with self.lock:
+            self.assignment.pop(name, None)
+            self.forwarded.pop(name, None)
+            self.undelivered.pop(name, None)
+
+    def forward(self, parts):
+        # acknowledge the camera, echoing the envelope of REQ senders, then
+        # pass the message on untouched
+        (identity, envelope, md, payload) = (parts[0], parts[1:-2], parts[-2], parts[-1])
+        self.frontend.send_multipart([identity] + [b""] * len(envelope) + [acknowledgement()], zmq.NOBLOCK)
+        name = json.loads(md.bytes)["msg"]
+        if self.touch is not None:
+            self.touch(name)
+        worker = self.worker_for(name)
+        if worker is None:
+            self.count(self.undelivered, name)
+            return
+        try:
+            self.backend.send_multipart([worker, md, payload], zmq.NOBLOCK, copy=False)
+            self.count(self.forwarded, name)
+        except zmq.ZMQError:
+            self.count(self.undelivered, name)
+
+    def count(self, counters, name):
+        with self.lock:
+            counters[name] = counters.get(name, 0) + 1
+
+    def stats(self):
+        """
+        Function reports the worker every camera is assigned to and its forwarded frames
+        :return: Dictionary mapping the camera name to its worker and frame counters
+        """
+        # the broker thread adds cameras while this runs on a web thread
+        with self.lock:
+            (assignment, forwarded, undelivered) = (dict(self.assignment), dict(self.forwarded),
+                                                    dict(self.undelivered))
+        return {name: {"worker": assignment[name].hex() if name in assignment else None,
+                       "forwarded": forwarded.get(name, 0),
+                       "undelivered": undelivered.get(name, 0)}
+                for name in set(forwarded) | set(undelivered)}
+
+
+class WorkerLink:
+    """
+    Connection of a recognition worker to the broker and the aggregator. Frames arrive on a DEALER
+    socket that also carries the heartbeats, and results leave on a PUSH socket shared by the worker
+    threads.
+    """
+
+    def __init__(self, host="localhost", backend_port=BACKEND_PORT, results_port=RESULTS_PORT, hwm=2):
+        self.context = zmq.Context()
+        self.frames = self.context.socket(zmq.DEALER)
+        self.frames.setsockopt(zmq.RCVHWM, hwm)
+        self.frames.connect("tcp://{}:{}".format(host, backend_port))
+        self.results = self.context.socket(zmq.PUSH)
+        self.results.setsockopt(zmq.SNDHWM, hwm)
+        self.results.setsockopt(zmq.LINGER, 0)
+        self.results.connect("tcp://{}:{}".format(host, results_port))
+        self.lock = threading.Lock()
+        self.lastBeat = 0.0
+        self.frames.send(READY)
+
+    def receive(self, timeout):
+        """
+        Function waits for the next frame, sending a heartbeat when one is due
+        :param timeout: Maximum seconds to wait
+        :return: Tuple of the metadata dictionary and the frame, None if no frame arrived in time
+        """
+        if time.monotonic() - self.lastBeat >= HEARTBEAT_SECONDS:
+            self.frames.send(HEARTBEAT)
+            self.lastBeat = time.monotonic()
+        if not self.frames.poll(min(timeout, HEARTBEAT_SECONDS) * 1000):
+            return None
+        (md, payload) = self.frames.recv_multipart(copy=False)
+        md = json.loads(md.bytes)
+        return md, parse_frame(md, payload)
+
+    def publish(self, name, jpeg, counts, stamp=None):
+        """
+        Function sends an annotated frame and its detections to the aggregator, dropping it if the
+        aggregator is not keeping up
+        :param name: Name of the camera
+        :param jpeg: JPEG bytes of the annotated frame
+        :param counts: Dictionary of the object counts of the frame
+        :param stamp: Dictionary of the sequence number and capture time of the frame, if known
+        """
+        md = json.dumps(dict(stamp or {}, msg=name, counts=counts, time=time.time())).encode()
+        with self.lock:
+            try:
+                self.results.send_multipart([md, jpeg], zmq.NOBLOCK)
+            except zmq.Again:
+                pass
+
+
+class ResultCollector:
+    """
+    Central end of the results sent by the workers, a PULL socket all the workers push to
+    """
+
+    def __init__(self, results_port=RESULTS_PORT):
+        self.context = zmq.Context()
+        self.socket = self.context.socket(zmq.PULL)
+        self.socket.bind("tcp://*:{}".format(results_port))
+
+    def receive(self, timeout=None):
+        """
+        Function waits for the next result
+        :param timeout: Maximum seconds to wait, None to wait forever
+        :return: Tuple of the metadata dictionary and the JPEG bytes, None if nothing arrived in time
+        """
+        if not self.socket.poll(None if timeout is None else timeout * 1000):
+            return None
+        (md, jpeg) = self.socket.recv_multipart()
+        return json.loads(md), jpeg
@@ -0,0 +1,171 @@
+# clips.py
+
+"""
+This module contains the pre-event buffers that keep the last seconds of every camera as JPEG frames, so
+that a clip of what led up to an alert can be cut on demand
+"""
+
+import shutil
+import subprocess
+import threading
+import time
+from collections import deque
+
+import numpy as np
+import cv2
+
+# quality the frames that did not arrive as JPEG are encoded with
+CLIP_QUALITY = 80
+
+
+class ClipError(Exception):
+    """
+    Raised when a clip cannot be produced
+    """
+
+
+class PreEventBuffer:
+    """
+    Ring of (timestamp, JPEG bytes) frames of one camera. Frames older than the window are dropped, and so
+    are the oldest frames once the buffer holds more bytes than its budget, so the memory a camera takes
+    never exceeds the budget whatever its resolution or frame rate.
+    """
+
+    def __init__(self, seconds, max_bytes):
+        self.seconds = seconds
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.frames = deque()
+        self.bytes = 0
+        self.evicted = 0
+
+    def append(self, jpeg, timestamp=None):
+        """
+        Function adds a frame, dropping the frames that fall out of the window or the budget
+        :param jpeg: JPEG bytes of the frame
+        :param timestamp: Monotonic time of the frame, the current time if None
+        """
+        timestamp = time.monotonic() if timestamp is None else timestamp
+        with self.lock:
+            self.frames.append((timestamp, jpeg))
+            self.bytes += len(jpeg)
+            while self.frames and (self.bytes > self.max_bytes or self.frames[0][0] < timestamp - self.seconds):
+                self.bytes -= len(self.frames.popleft()[1])
+                self.evicted += 1
+
+    def recent(self, seconds=None):
+        """
+        Function returns the frames of the last seconds
+        :param seconds: Length of the window, the whole buffer if None
+        :return: List of (timestamp, JPEG bytes) in the order they were received
+        """
+        with self.lock:
+            frames = list(self.frames)
+        if seconds is not None and frames:
+            frames = [frame for frame in frames if frame[0] >= frames[-1][0] - seconds]
+        return frames
+
+    def stats(self):
+        """
+        Function reports the memory used by the buffer and the footage it holds
+        :return: Dictionary of the bytes, frames and seconds buffered and the frames dropped
+        """
+        with self.lock:
+            span = self.frames[-1][0] - self.frames[0][0] if self.frames else 0.0
+            return {"clip_bytes": self.bytes, "clip_frames": len(self.frames),
+                    "clip_seconds": span, "clip_evicted": self.evicted}
+
+
+class ClipRecorder:
+    """
+    Keeps a pre-event buffer per camera and cuts MP4 clips out of them. Frames that arrived as JPEG are
+    buffered as they are; only raw frames are encoded.
+    """
+
+    def __init__(self, seconds=10.0, max_bytes=8 * 1024 * 1024, ffmpeg="ffmpeg"):
+        self.seconds = seconds
+        self.max_bytes = max_bytes
+        self.ffmpeg = ffmpeg
+        self.buffers = {}
+
+    def record(self, name, frame, jpeg=None):
+        """
+        Function buffers a frame of a camera
+        :param name: Name of the camera
+        :param frame: BGR frame, encoded if no JPEG is given
+        :param jpeg: JPEG bytes the camera sent the frame as
+        """
+        if jpeg is None:
+            (flag, encoded) = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, CLIP_QUALITY])
+            if not flag:
+                return
+            jpeg = encoded.tobytes()
+        if name not in self.buffers:
+            self.buffers[name] = PreEventBuffer(self.seconds, self.max_bytes)
+        self.buffers[name].append(jpeg)
+
+    def discard(self, name):
+        """
+        Function frees the buffer of a camera that went silent
+        :param name: Name of the camera
+        """
+        self.buffers.pop(name, None)
+
+    def keyframe(self, name):
+        """
+        Function returns the latest buffered frame of a camera
+        :param name: Name of the camera
+        :return: JPEG bytes, None if nothing is buffered
+        """
+        frames = self.buffers[name].recent() if name in self.buffers else []
+        return frames[-1][1] if frames else None
+
+    def clip(self, name, seconds=None):
+        """
+        Function encodes the last seconds of a camera as an MP4 clip. The buffered JPEG frames are piped
+        into a single ffmpeg process, which only encodes the frames of the clip.
+        :param name: Name of the camera
+        :param seconds: Length of the clip, the whole buffer if None
+        :return: MP4 bytes
+        """
+        frames = self.buffers[name].recent(seconds) if name in self.buffers else []
+        if len(frames) < 2:
+            raise ClipError("not enough frames buffered for {}".format(name))
+        if shutil.which(self.ffmpeg) is None:
+            raise ClipError("{} not found".format(self.ffmpeg))
+        # play the clip back at the rate the frames were received at
+        rate = (len(frames) - 1) / max(frames[-1][0] - frames[0][0], 1e-3)
+        # the camera may change its frame size during the clip, so every
+        # frame is fitted into the even size of the first one
+        first = cv2.imdecode(np.frombuffer(frames[0][1], dtype=np.uint8), cv2.IMREAD_GRAYSCALE)
+        if first is None:
+            raise ClipError("undecodable frame buffered for {}".format(name))
+        (h, w) = first.shape
+        size = "{}:{}".format(w + w % 2, h + h % 2)
+        # a fragmented MP4 can be written to a pipe as it needs no seeking
+        command = [self.ffmpeg, "-loglevel", "error", "-f", "image2pipe", "-c:v", "mjpeg",
+                   "-framerate", "{:.3f}".format(rate), "-i", "-",
+                   "-c:v", "libx264", "-preset", "veryfast", "-pix_fmt", "yuv420p",
+                   "-vf", "scale={}:force_original_aspect_ratio=decrease,pad={}:(ow-iw)/2:(oh-ih)/2".format(size, size),
+                   "-movflags", "frag_keyframe+empty_moov", "-f", "mp4", "-"]
+        result = subprocess.run(command, input=b"".join(jpeg for (_, jpeg) in frames),
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        if result.returncode != 0:
+            raise ClipError(result.stderr.decode(errors="replace").strip())
+        return result.stdout
+
+    def attachment(self, name, seconds=None):
+        """
+        Function builds the clip of a camera in the (name, media type, data) form the alert emails take
+        :param name: Name of the camera
+        :param seconds: Length of the clip, the whole buffer if None
+        :return: Tuple of the file name, media type and MP4 bytes
+        """
+        return "{}.mp4".format(name.replace("/", "_")), "video/mp4", self.clip(name, seconds)
+
+    def stats(self):
+        """
+        Function reports the memory used by the buffer of every camera
+        :return: Dictionary mapping the camera name to the statistics of its buffer
+        """
+        return {name: buffer.stats() for (name, buffer) in list(self.buffers.items())}
@@ -0,0 +1,92 @@
+# detection.py
+
+"""
+This module contains the MobileNet SSD inference helpers shared by the recognition loop
+"""
+
+import time
+
+import numpy as np
+import cv2
+
+# size and normalisation the MobileNet SSD network was trained with
+BLOB_SIZE = (300, 300)
+BLOB_SCALE = 0.007843
+BLOB_MEAN = 127.5
+
+
+def detect_batch(net, frames, timings=None):
+    """
+    Function runs a single forward pass over several frames and splits the detections per frame
+    :param net: Network loaded with cv2.dnn
+    :param frames: List of BGR frames, possibly from different cameras and of different sizes
+    :param timings: Dictionary the seconds spent building the blob and in the forward pass are stored in
+    :return: List with one (N, 7) detections array per frame, in the order the frames were given
+    """
+    if not frames:
+        return []
+    # stack every frame into one 4D blob so that the network overhead is paid
+    # once per batch instead of once per camera
+    start = time.perf_counter()
+    blob = cv2.dnn.blobFromImages([cv2.resize(frame, BLOB_SIZE) for frame in frames],
+                                  BLOB_SCALE, BLOB_SIZE, BLOB_MEAN)
+    net.setInput(blob)
+    blobbed = time.perf_counter()
+    detections = net.forward()
+    if timings is not None:
+        timings["blob"] = blobbed - start
+        timings["forward"] = time.perf_counter() - blobbed
+    return scatter_detections(detections, len(frames))
+
+
+def scatter_detections(detections, count):
+    """
+    Function splits the output of the DetectionOutput layer back into per-image arrays
+    :param detections: Network output of shape (1, 1, N, 7), column 0 holding the image index
+    :param count: Number of images in the batch
+    :return: List of (N_i, 7) arrays, one per image
+    """
+    rows = detections.reshape(-1, 7)
+    # the detection layer pads its output with a row whose image index is -1
+    # when nothing was found, so those rows never match any image
+    image_ids = rows[:, 0].astype("int")
+    return [rows[image_ids == i] for i in range(count)]
+
+
+def class_mask(classes, consider):
+    """
+    Function builds a lookup telling for every class index whether the class is counted
+    :param classes: Class labels in the order of the network output
+    :param consider: Set of labels to count
+    :return: Boolean array indexed by class index
+    """
+    return np.array([label in consider for label in classes], dtype=bool)
+
+
+def filter_detections(detections, confidence, mask, size, nms_threshold=0.0):
+    """
+    Function keeps the confident detections of counted classes and scales their boxes to the frame
+    :param detections: (N, 7) detections of one frame
+    :param confidence: Minimum confidence
+    :param mask: Boolean lookup returned by class_mask
+    :param size: Tuple of the frame width and height
+    :param nms_threshold: Overlap above which duplicate boxes of a class are removed, 0 to keep all boxes
+    :return: Tuple of an (M, 4) int array of boxes and an (M,) array of their class indices
+    """
+    (w, h) = size
+    classIds = detections[:, 1].astype("int")
+    # indices outside the label list are not counted, as the network may
+    # know more classes than listed
+    keep = (detections[:, 2] > confidence) & (classIds >= 0) & (classIds < len(mask))
+    keep[keep] = mask[classIds[keep]]
+    (rows, classIds) = (detections[keep], classIds[keep])
+    boxes = (rows[:, 3:7] * np.array([w, h, w, h])).astype("int")
+    if nms_threshold and len(rows) > 1:
+        # shift every class to its own region so that one NMS call only
+        # suppresses overlapping boxes of the same class
+        offset = (classIds * (max(w, h) + 1))[:, None]
+        rects = np.hstack([boxes[:, :2] + offset, boxes[:, 2:] - boxes[:, :2]])
+        picked = np.array(cv2.dnn.NMSBoxes(rects.tolist(), rows[:, 2].tolist(), confidence, nms_threshold),
+                          dtype="int").reshape(-1)
+        (boxes, classIds) = (boxes[picked], classIds[picked])
+    return boxes, classIds
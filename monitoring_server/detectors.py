@@ -0,0 +1,103 @@
+# detectors.py
+
+"""
+This module contains the loaders of the detection networks the server can run: the Caffe MobileNet SSD,
+ONNX exports of it run by cv2.dnn or by onnxruntime, and int8 quantized ONNX models. Every loader returns
+an object with the setInput() and forward() methods of a cv2.dnn network, so detect_batch() runs any of
+them. ONNX models are expected to take the same 300x300 blob and to give the same (1, 1, N, 7) output as
+the DetectionOutput layer of the Caffe model.
+"""
+
+import numpy as np
+import cv2
+
+ENGINES = ["caffe", "onnx", "onnxruntime"]
+BACKENDS = {"default": cv2.dnn.DNN_BACKEND_DEFAULT,
+            "opencv": cv2.dnn.DNN_BACKEND_OPENCV,
+            "openvino": cv2.dnn.DNN_BACKEND_INFERENCE_ENGINE,
+            "cuda": cv2.dnn.DNN_BACKEND_CUDA,
+            "vulkan": cv2.dnn.DNN_BACKEND_VKCOM}
+TARGETS = {"cpu": cv2.dnn.DNN_TARGET_CPU,
+           "opencl": cv2.dnn.DNN_TARGET_OPENCL,
+           "opencl_fp16": cv2.dnn.DNN_TARGET_OPENCL_FP16,
+           "cuda": cv2.dnn.DNN_TARGET_CUDA,
+           "cuda_fp16": cv2.dnn.DNN_TARGET_CUDA_FP16,
+           "myriad": cv2.dnn.DNN_TARGET_MYRIAD,
+           "vulkan": cv2.dnn.DNN_TARGET_VULKAN}
+
+
+class OnnxRuntimeNet:
+    """
+    Runs an ONNX model with onnxruntime on the CPU behind the setInput() and forward() methods of a
+    cv2.dnn network. Models exported with a fixed batch of one are run once per image and their
+    detections given the index of the image, as the DetectionOutput layer does for a batch.
+    """
+
+    def __init__(self, model, threads=0):
+        # onnxruntime is only needed when this engine is chosen
+        import onnxruntime
+
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = threads
+        self.session = onnxruntime.InferenceSession(model, options, providers=["CPUExecutionProvider"])
+        self.input = self.session.get_inputs()[0]
+        self.single = self.input.shape[0] == 1
+        self.blob = None
+
+    def setInput(self, blob):
+        self.blob = blob
+
+    def forward(self):
+        blobs = [self.blob[i:i + 1] for i in range(len(self.blob))] if self.single else [self.blob]
+        outputs = []
+        for (i, blob) in enumerate(blobs):
+            rows = self.session.run(None, {self.input.name: blob})[0].reshape(-1, 7)
+            if self.single:
+                rows = rows.copy()
+                # keep the padding rows of an image without detections at -1
+                rows[rows[:, 0] >= 0, 0] = i
+            outputs.append(rows)
+        return np.concatenate(outputs).reshape(1, 1, -1, 7)
+
+
+def load_net(engine="caffe", model="caffemodel", prototxt="prototxt.txt", backend="default", target="cpu"):
+    """
+    Function loads a detection network
+    :param engine: caffe, onnx for cv2.dnn.readNetFromONNX or onnxruntime
+    :param model: Path to the Caffe model or the ONNX model, quantized or not
+    :param prototxt: Path to the Caffe deploy prototxt file, used by the caffe engine only
+    :param backend: cv2.dnn backend name, one of BACKENDS
+    :param target: cv2.dnn target name, one of TARGETS
+    :return: Network with the setInput() and forward() methods of a cv2.dnn network
+    """
+    if engine == "onnxruntime":
+        return OnnxRuntimeNet(model)
+    if engine == "onnx":
+        net = cv2.dnn.readNetFromONNX(model)
+    elif engine == "caffe":
+        net = cv2.dnn.readNetFromCaffe(prototxt, model)
+    else:
+        raise ValueError("unknown detector engine {}".format(engine))
+    net.setPreferableBackend(BACKENDS[backend])
+    net.setPreferableTarget(TARGETS[target])
+    return net
+
+
+def net_options(args):
+    """
+    Function picks the options of load_net out of the server arguments
+    :param args: Dictionary of the server arguments
+    :return: Dictionary of the load_net keyword arguments
+    """
+    return {option: args[option] for option in ("engine", "model", "prototxt", "backend", "target")}
+
+
+def quantize(model, output):
+    """
+    Function writes an int8 copy of an ONNX model, quantizing the weights with onnxruntime
+    :param model: Path to the float ONNX model
+    :param output: Path the quantized model is written to
+    """
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    quantize_dynamic(model, output, weight_type=QuantType.QInt8)
@@ -0,0 +1,174 @@
+# ingest.py
+
+"""
+This module contains the per-camera frame slots that decouple receiving frames from running inference on them,
+and the sequencing that puts the frames of a camera in order
+"""
+
+import threading
+
+# how far back the number of a camera that sends no session may jump before
+# the camera is taken to have restarted rather than its frame to be stale
+RESTART_GAP = 100
+
+
+class FrameSlots:
+    """
+    Holds at most one pending frame per camera. A new frame from a camera overwrites the one still
+    waiting, so a slow inference stage drops stale frames instead of queueing them.
+    """
+
+    def __init__(self):
+        self.ready = threading.Condition()
+        # pending frames in arrival order, the camera waiting the longest first
+        self.pending = {}
+        # cameras whose frame is currently being processed by a worker
+        self.busy = set()
+        # what was stored along with the pending frames and with the frames
+        # being processed, such as their capture time
+        self.stamps = {}
+        self.current = {}
+        self.received = {}
+        self.dropped = {}
+        self.processed = {}
+
+    def put(self, name, frame, stamp=None):
+        """
+        Function stores the latest frame of a camera, replacing any frame not yet picked up
+        :param name: Name of the camera
+        :param frame: Frame received from the camera
+        :param stamp: Anything to keep with the frame until it is processed
+        """
+        with self.ready:
+            # the frame replaces the waiting one in place, so the camera keeps
+            # its turn instead of going to the back of the queue
+            if name in self.pending:
+                self.dropped[name] = self.dropped.get(name, 0) + 1
+            self.pending[name] = frame
+            self.stamps[name] = stamp
+            self.received[name] = self.received.get(name, 0) + 1
+            self.ready.notify_all()
+
+    def available(self):
+        """
+        Function counts the pending frames that no worker is processing yet
+        :return: Number of frames that can be taken
+        """
+        return sum(1 for name in self.pending if name not in self.busy)
+
+    def wait(self, count=1, timeout=None):
+        """
+        Function blocks until the given number of frames can be taken or the timeout elapses
+        :param count: Number of frames to wait for
+        :param timeout: Maximum seconds to wait, None to wait forever
+        :return: Number of frames that can be taken
+        """
+        with self.ready:
+            self.ready.wait_for(lambda: self.available() >= count, timeout)
+            return self.available()
+
+    def take(self, limit):
+        """
+        Function removes up to limit pending frames, skipping cameras another worker is still processing
+        so that frames of a camera are always handled in order
+        :param limit: Maximum number of frames to take
+        :return: Dictionary mapping the camera name to its frame
+        """
+        with self.ready:
+            names = [name for name in self.pending if name not in self.busy][:limit]
+            self.busy.update(names)
+            for name in names:
+                self.current[name] = self.stamps.pop(name, None)
+            return {name: self.pending.pop(name) for name in names}
+
+    def stamp(self, name):
+        """
+        Function returns what was stored with the frame of a camera that is being processed
+        :param name: Name of the camera
+        :return: Stamp given to put, None if there is none
+        """
+        return self.current.get(name)
+
+    def done(self, names):
+        """
+        Function marks the frames of the given cameras as processed, allowing their next frame to be taken
+        :param names: Names of the cameras returned by take
+        """
+        with self.ready:
+            for name in names:
+                self.busy.discard(name)
+                self.current.pop(name, None)
+                self.processed[name] = self.processed.get(name, 0) + 1
+            self.ready.notify_all()
+
+    def overwritten(self, name):
+        """
+        Function counts the frames of a camera that were overwritten before a worker took them
+        :param name: Name of the camera
+        :return: Number of dropped frames
+        """
+        return self.dropped.get(name, 0)
+
+    def discard(self, name):
+        """
+        Function drops the frame of a camera that has not been picked up yet
+        :param name: Name of the camera
+        """
+        with self.ready:
+            self.pending.pop(name, None)
+            self.stamps.pop(name, None)
+
+    def stats(self):
+        """
+        Function reports the frame counters of every camera
+        :return: Dictionary mapping the camera name to its received, dropped and processed frame counts
+        """
+        with self.ready:
+            return {name: {"received": count,
+                           "dropped": self.dropped.get(name, 0),
+                           "processed": self.processed.get(name, 0),
+                           "pending": int(name in self.pending)}
+                    for (name, count) in self.received.items()}
+
+
+class CameraSequence:
+    """
+    Orders the frames of one camera. Cameras that number their frames have stale and duplicate frames
+    dropped and the frames they never delivered counted; the frames of other cameras are numbered here.
+    A camera that starts a new session, such as after a restart, is numbered from the start again.
+    """
+
+    def __init__(self):
+        self.session = None
+        self.last = 0
+        self.received = 0
+        self.missing = 0
+        self.stale = 0
+
+    def accept(self, seq=None, session=None):
+        """
+        Function decides whether a frame is newer than the last one accepted
+        :param seq: Sequence number the camera gave the frame, None if it numbers nothing
+        :param session: Identifier the camera numbers its frames under, None if it sends none
+        :return: Sequence number of the frame, None if the frame is stale
+        """
+        self.received += 1
+        if session != self.session:
+            # the numbers of a new session do not follow those of the last
+            self.session = session
+            self.last = 0
+        if seq is None:
+            seq = self.last + 1
+        elif seq <= self.last:
+            # an older frame overtaken by a newer one is of no use any more,
+            # unless a camera that sends no session restarted its numbering
+            if session is not None or self.last - seq < RESTART_GAP:
+                self.stale += 1
+                return None
+        elif self.last:
+            self.missing += seq - self.last - 1
+        self.last = seq
+        return seq
+
+    def stats(self):
+        return {"sequence": self.last, "missing": self.missing, "stale": self.stale}
@@ -0,0 +1,81 @@
+# liveness.py
+
+"""
+This module contains the liveness monitor that notices cameras connecting and going silent
+"""
+
+import heapq
+import threading
+import time
+
+
+class LivenessMonitor:
+    """
+    Keeps the last time every camera sent a frame and a heap of their deadlines, so that finding the
+    cameras that went silent only looks at the top of the heap instead of at every camera. A camera has
+    at most one entry in the heap: an entry whose camera sent a frame since it was pushed is pushed
+    back with the new deadline when it reaches the top.
+    """
+
+    def __init__(self, timeout):
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.lastActive = {}
+        self.deadlines = []
+        self.subscribers = []
+
+    def subscribe(self, callback):
+        """
+        Function registers a callback for the connect and disconnect events
+        :param callback: Called with the event, "connect" or "disconnect", and the name of the camera
+        """
+        self.subscribers.append(callback)
+
+    def emit(self, event, name):
+        for callback in self.subscribers:
+            callback(event, name)
+
+    def touch(self, name, now=None):
+        """
+        Function records that a camera just sent a frame, announcing cameras that were not active
+        :param name: Name of the camera
+        :param now: Monotonic time of the frame, the current time if None
+        """
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            new = name not in self.lastActive
+            self.lastActive[name] = now
+            if new:
+                heapq.heappush(self.deadlines, (now + self.timeout, name))
+        if new:
+            self.emit("connect", name)
+
+    def next_deadline(self):
+        """
+        Function returns the earliest time a camera may go stale
+        :return: Monotonic time, None if no camera is active
+        """
+        with self.lock:
+            return self.deadlines[0][0] if self.deadlines else None
+
+    def expire(self, now=None):
+        """
+        Function removes the cameras that sent nothing for longer than the timeout and announces them
+        :param now: Monotonic time to check against, the current time if None
+        :return: List of the names of the removed cameras
+        """
+        now = time.monotonic() if now is None else now
+        stale = []
+        with self.lock:
+            while self.deadlines and self.deadlines[0][0] <= now:
+                (_, name) = heapq.heappop(self.deadlines)
+                deadline = self.lastActive[name] + self.timeout
+                if deadline > now:
+                    # the camera sent frames since the entry was pushed
+                    heapq.heappush(self.deadlines, (deadline, name))
+                else:
+                    del self.lastActive[name]
+                    stale.append(name)
+        for name in stale:
+            self.emit("disconnect", name)
+        return stale
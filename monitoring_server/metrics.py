@@ -0,0 +1,145 @@
+# metrics.py
+
+"""
+This module contains the per-camera stage timings of the vision server and their rendering in the
+Prometheus text format
+"""
+
+import bisect
+import threading
+import time
+from collections import deque
+
+# upper bounds in seconds of the histogram buckets, from sub-millisecond
+# drawing up to multi-second forward passes
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+# number of recent samples the quantiles are computed over
+WINDOW = 256
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class StageHistogram:
+    """
+    Cumulative bucket counts as Prometheus expects them, plus a window of the latest samples for quantiles
+    that follow what the server is doing right now.
+    """
+
+    def __init__(self):
+        self.buckets = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.recent = deque(maxlen=WINDOW)
+
+    def observe(self, seconds):
+        self.buckets[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.sum += seconds
+        self.count += 1
+        self.recent.append(seconds)
+
+    def quantiles(self):
+        samples = sorted(self.recent)
+        if not samples:
+            return {}
+        return {q: samples[min(int(q * len(samples)), len(samples) - 1)] for q in QUANTILES}
+
+
+class Metrics:
+    """
+    Collects stage timings and frame rates per camera. Recording a sample only takes a lock, a bisect and
+    a few increments, so the instrumentation stays far below a percent of a loop.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stages = {}
+        self.frames = {}
+
+    def observe(self, stage, cameras, seconds):
+        """
+        Function records the time a stage took
+        :param stage: Name of the stage
+        :param cameras: Names of the cameras the stage processed a frame of
+        :param seconds: Duration of the stage
+        """
+        with self.lock:
+            for camera in cameras:
+                key = (stage, camera)
+                if key not in self.stages:
+                    self.stages[key] = StageHistogram()
+                self.stages[key].observe(seconds)
+
+    def quantiles(self, stage):
+        """
+        Function computes the recent quantiles of a stage for every camera
+        :param stage: Name of the stage
+        :return: Dictionary mapping the camera name to a dictionary of quantile to seconds
+        """
+        with self.lock:
+            return {camera: histogram.quantiles() for ((name, camera), histogram) in self.stages.items()
+                    if name == stage}
+
+    def frame(self, cameras):
+        """
+        Function records that a frame of each camera went through the whole pipeline
+        :param cameras: Names of the cameras
+        """
+        now = time.monotonic()
+        with self.lock:
+            for camera in cameras:
+                if camera not in self.frames:
+                    self.frames[camera] = deque(maxlen=WINDOW)
+                self.frames[camera].append(now)
+
+    def fps(self):
+        """
+        Function computes the recent frame rate of every camera
+        :return: Dictionary mapping the camera name to its frames per second
+        """
+        now = time.monotonic()
+        with self.lock:
+            rates = {}
+            for (camera, stamps) in self.frames.items():
+                elapsed = now - stamps[0]
+                rates[camera] = (len(stamps) - 1) / elapsed if len(stamps) > 1 and elapsed > 0 else 0.0
+            return rates
+
+    def render(self, series=()):
+        """
+        Function renders the metrics in the Prometheus text exposition format
+        :param series: Extra (name, type, help, {camera: value}) series to include, a None camera for an
+            unlabelled value
+        :return: Text of the metrics
+        """
+        lines = ["# HELP monitoring_stage_seconds Time spent in each pipeline stage",
+                 "# TYPE monitoring_stage_seconds histogram"]
+        with self.lock:
+            histograms = sorted(self.stages.items())
+            for ((stage, camera), histogram) in histograms:
+                labels = 'camera="{}",stage="{}"'.format(escape(camera), stage)
+                cumulative = 0
+                for (bound, count) in zip(BUCKETS + ("+Inf",), histogram.buckets):
+                    cumulative += count
+                    lines.append('monitoring_stage_seconds_bucket{{{},le="{}"}} {}'.format(labels, bound, cumulative))
+                lines.append("monitoring_stage_seconds_sum{{{}}} {}".format(labels, histogram.sum))
+                lines.append("monitoring_stage_seconds_count{{{}}} {}".format(labels, histogram.count))
+            lines.append("# HELP monitoring_stage_recent_seconds Quantiles of the last {} samples of each stage".format(WINDOW))
+            lines.append("# TYPE monitoring_stage_recent_seconds gauge")
+            for ((stage, camera), histogram) in histograms:
+                for (q, value) in histogram.quantiles().items():
+                    lines.append('monitoring_stage_recent_seconds{{camera="{}",stage="{}",quantile="{}"}} {}'.format(
+                        escape(camera), stage, q, value))
+        fps = ("monitoring_camera_fps", "gauge", "Frames per second processed per camera", self.fps())
+        for (name, kind, description, values) in (fps,) + tuple(series):
+            lines.append("# HELP {} {}".format(name, description))
+            lines.append("# TYPE {} {}".format(name, kind))
+            for (camera, value) in sorted(values.items(), key=lambda item: str(item[0])):
+                if camera is None:
+                    lines.append("{} {}".format(name, value))
+                else:
+                    lines.append('{}{{camera="{}"}} {}'.format(name, escape(camera), value))
+        return "\n".join(lines) + "\n"
+
+
+def escape(value):
+    # label values may not contain raw backslashes, quotes or newlines
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
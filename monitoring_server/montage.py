@@ -0,0 +1,68 @@
+# montage.py
+
+"""
+This module contains the montage canvas that shows every camera in its own tile of a single frame
+"""
+
+import heapq
+import threading
+
+import numpy as np
+import cv2
+
+
+class MontageCanvas:
+    """
+    Preallocated montage in which every camera keeps the same tile. A new frame only repaints the tile
+    of its camera, so the cost of a frame does not depend on how many cameras are shown. The grid grows
+    by a row once more cameras connect than it has tiles, and the tiles of removed cameras are handed to
+    the next cameras that connect.
+    """
+
+    def __init__(self, tile_size, columns, rows):
+        (self.tileW, self.tileH) = tile_size
+        self.columns = max(columns, 1)
+        self.rows = max(rows, 1)
+        self.lock = threading.Lock()
+        self.image = np.zeros((self.rows * self.tileH, self.columns * self.tileW, 3), dtype=np.uint8)
+        self.slots = {}
+        self.free = []
+        self.dirty = False
+
+    def slot(self, name):
+        # give a new camera the first free tile, adding a row when all are taken
+        if name not in self.slots:
+            index = heapq.heappop(self.free) if self.free else len(self.slots)
+            if index >= self.columns * self.rows:
+                self.rows += 1
+                self.image = np.vstack([self.image, np.zeros((self.tileH, self.columns * self.tileW, 3), np.uint8)])
+            self.slots[name] = index
+        return self.slots[name]
+
+    def update(self, name, frame):
+        """
+        Function paints the frame of a camera into its tile and marks the canvas as changed
+        :param name: Name of the camera
+        :param frame: BGR frame, resized to the tile if needed
+        """
+        with self.lock:
+            (row, column) = divmod(self.slot(name), self.columns)
+            tile = self.image[row * self.tileH:(row + 1) * self.tileH, column * self.tileW:(column + 1) * self.tileW]
+            if frame.shape[:2] != (self.tileH, self.tileW):
+                frame = cv2.resize(frame, (self.tileW, self.tileH))
+            tile[...] = frame
+            self.dirty = True
+
+    def remove(self, name):
+        """
+        Function blanks the tile of a camera and frees it for the next camera
+        :param name: Name of the camera
+        """
+        with self.lock:
+            if name not in self.slots:
+                return
+            index = self.slots.pop(name)
+            heapq.heappush(self.free, index)
+            (row, column) = divmod(index, self.columns)
+            self.image[row * self.tileH:(row + 1) * self.tileH, column * self.tileW:(column + 1) * self.tileW] = 0
+            self.dirty = True
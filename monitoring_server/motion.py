@@ -0,0 +1,84 @@
+# motion.py
+
+"""
+This module contains the motion gate that lets the detector skip frames of a static scene
+"""
+
+import time
+
+import numpy as np
+import imutils
+import cv2
+
+# width the frames are downscaled to before looking for motion, and the
+# grey level change a pixel needs to count as changed
+GATE_WIDTH = 160
+PIXEL_THRESHOLD = 25
+
+
+class MotionGate:
+    """
+    Decides per camera whether a frame differs enough from the last frame the detector ran on. Frames of
+    a static scene reuse the last detections instead of running the detector.
+    """
+
+    def __init__(self, threshold=0.01, interval=5.0, method="diff"):
+        self.threshold = threshold
+        self.interval = interval
+        self.subtractor = cv2.createBackgroundSubtractorMOG2(detectShadows=True) if method == "mog2" else None
+        self.reference = None
+        self.small = None
+        self.rows = None
+        self.lastRun = 0.0
+        self.checked = 0
+        self.skipped = 0
+
+    def changed(self, frame):
+        """
+        Function measures the fraction of pixels that changed in a downscaled grayscale copy of the frame
+        :param frame: BGR frame
+        :return: Fraction of changed pixels between 0 and 1
+        """
+        gray = cv2.cvtColor(imutils.resize(frame, width=GATE_WIDTH, inter=cv2.INTER_AREA), cv2.COLOR_BGR2GRAY)
+        self.small = cv2.GaussianBlur(gray, (5, 5), 0)
+        if self.subtractor is not None:
+            # MOG2 marks foreground 255 and shadows 127, shadows are not motion
+            mask = self.subtractor.apply(self.small)
+            return np.count_nonzero(mask == 255) / mask.size
+        if self.reference is None:
+            return 1.0
+        # compare against the frame the detector last ran on so that slow
+        # movements add up instead of vanishing between consecutive frames
+        diff = cv2.absdiff(self.reference, self.small)
+        return np.count_nonzero(diff > PIXEL_THRESHOLD) / diff.size
+
+    def check(self, frame):
+        """
+        Function decides whether the detector has to run on a frame
+        :param frame: BGR frame
+        :return: True if enough of the scene changed or the last detector run is too old
+        """
+        fraction = self.changed(frame)
+        self.checked += 1
+        if self.rows is None or fraction > self.threshold or time.monotonic() - self.lastRun >= self.interval:
+            return True
+        self.skipped += 1
+        return False
+
+    def remember(self, rows):
+        """
+        Function stores the detections of the frame the detector just ran on
+        :param rows: (N, 7) detections
+        """
+        self.rows = rows.copy()
+        self.reference = self.small
+        self.lastRun = time.monotonic()
+
+    def stats(self):
+        """
+        Function reports how many frames the gate let the detector skip
+        :return: Dictionary of the checked and skipped frame counts and the skip ratio
+        """
+        return {"motion_checked": self.checked,
+                "motion_skipped": self.skipped,
+                "skip_ratio": self.skipped / self.checked if self.checked else 0.0}
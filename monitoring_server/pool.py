@@ -0,0 +1,265 @@
+# pool.py
+
+"""
+This module contains the process pool that runs the detector on every core. Frames reach the worker
+processes through shared memory ring buffers, and every camera sticks to one worker so its frames are
+processed in order.
+"""
+
+import itertools
+import multiprocessing
+import queue
+import threading
+import traceback
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from detection import detect_batch
+from detectors import load_net
+
+# bytes reserved per frame in the ring buffers, enough for a 400 pixel wide
+# frame up to 600 pixels high
+SLOT_BYTES = 400 * 600 * 3
+# seconds between the checks that the workers a request waits on are alive
+LIVENESS_CHECK_SECONDS = 1.0
+
+
+class FrameRing:
+    """
+    Fixed number of frame slots in a shared memory block. The process that creates the ring hands out
+    free slots and the worker process attaching to it by name reads the frames in place.
+    """
+
+    def __init__(self, slots, slot_bytes=SLOT_BYTES, name=None):
+        self.slots = slots
+        self.slot_bytes = slot_bytes
+        self.owner = name is None
+        self.shm = shared_memory.SharedMemory(name=name, create=self.owner, size=slots * slot_bytes)
+        self.free = queue.Queue()
+        if self.owner:
+            for slot in range(slots):
+                self.free.put(slot)
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def write(self, frame):
+        """
+        Function copies a frame into a free slot
+        :param frame: Frame to store
+        :return: Index of the slot, None if the frame does not fit or every slot is in use
+        """
+        if frame.dtype != np.uint8 or frame.nbytes > self.slot_bytes:
+            return None
+        try:
+            slot = self.free.get_nowait()
+        except queue.Empty:
+            return None
+        self.read(slot, frame.shape)[...] = frame
+        return slot
+
+    def read(self, slot, shape):
+        """
+        Function returns the frame stored in a slot without copying it
+        :param slot: Index of the slot
+        :param shape: Shape of the frame
+        :return: uint8 array backed by the shared memory
+        """
+        return np.ndarray(shape, dtype=np.uint8, buffer=self.shm.buf, offset=slot * self.slot_bytes)
+
+    def release(self, slot):
+        self.free.put(slot)
+
+    def close(self):
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+def serve(options, ring_name, slots, slot_bytes, requests, replies):
+    """
+    Function runs in a worker process: it loads its own network and answers detection requests
+    :param options: Keyword arguments of detectors.load_net
+    :param ring_name: Name of the shared memory block of the worker's ring
+    :param slots: Number of slots in the ring
+    :param slot_bytes: Bytes per slot
+    :param requests: Queue of (request id, [(slot, shape or frame)]) jobs, None to stop
+    :param replies: Queue the (request id, detections, timings, error) results are put on, error being
+        the traceback of a failed request and None otherwise
+    """
+    # a network that cannot be loaded fails every request with the reason,
+    # instead of leaving the server waiting for answers that never come
+    (net, failure) = (None, None)
+    try:
+        net = load_net(**options)
+    except Exception:
+        failure = traceback.format_exc()
+    ring = FrameRing(slots, slot_bytes, name=ring_name)
+    frames = []
+    try:
+        while True:
+            job = requests.get()
+            if job is None:
+                break
+            (request_id, items) = job
+            if failure is not None:
+                replies.put((request_id, [], {}, failure))
+                continue
+            # frames that did not get a slot are sent along with the request
+            frames = [ring.read(slot, frame) if slot is not None else frame for (slot, frame) in items]
+            timings = {}
+            try:
+                replies.put((request_id, detect_batch(net, frames, timings), timings, None))
+            except Exception:
+                replies.put((request_id, [], {}, traceback.format_exc()))
+    finally:
+        # the views into the ring have to go before the block can be closed
+        frames = None
+        ring.close()
+
+
+class InferencePool:
+    """
+    Runs the detector in several processes, each with its own network. detect() splits a batch by the
+    worker each camera is assigned to and blocks until every worker answered. A process that dies is
+    started again with a fresh ring, its cameras staying assigned to it.
+    """
+
+    def __init__(self, processes, options, slots=8, slot_bytes=SLOT_BYTES):
+        self.context = multiprocessing.get_context("spawn")
+        self.options = options
+        self.slots = slots
+        self.slot_bytes = slot_bytes
+        self.replies = self.context.Queue()
+        self.rings = [None] * processes
+        self.requests = [None] * processes
+        self.processes = [None] * processes
+        for worker in range(processes):
+            self.start(worker)
+        # guards the assignment, the requests waiting for a reply and the
+        # rings, which a restart replaces
+        self.lock = threading.Lock()
+        self.affinity = {}
+        self.waiting = {}
+        self.ids = itertools.count()
+        collector = threading.Thread(target=self.collect, daemon=True)
+        collector.start()
+
+    def start(self, worker):
+        # start the process of a worker with a ring and a request queue of its own
+        ring = FrameRing(self.slots, self.slot_bytes)
+        requests = self.context.Queue()
+        process = self.context.Process(target=serve, daemon=True, args=(
+            self.options, ring.name, self.slots, self.slot_bytes, requests, self.replies))
+        process.start()
+        (self.rings[worker], self.requests[worker], self.processes[worker]) = (ring, requests, process)
+
+    def restart(self, worker, process):
+        """
+        Function replaces a detector process that died, unless another thread already did
+        :param worker: Index of the worker
+        :param process: Process found dead
+        """
+        with self.lock:
+            if self.processes[worker] is not process:
+                return
+            print("[ERROR] detector process {} exited with code {}, restarting it".format(worker, process.exitcode))
+            # the requests the process took are never answered, and their
+            # slots go with its ring
+            ring = self.rings[worker]
+            for request_id in [request_id for (request_id, waiting) in self.waiting.items() if waiting[0] is ring]:
+                del self.waiting[request_id]
+            ring.close()
+            self.start(worker)
+
+    def worker_for(self, name):
+        """
+        Function returns the worker a camera is assigned to, assigning new cameras round robin
+        :param name: Name of the camera
+        :return: Index of the worker
+        """
+        with self.lock:
+            if name not in self.affinity:
+                self.affinity[name] = len(self.affinity) % len(self.processes)
+            return self.affinity[name]
+
+    def collect(self):
+        # hand every reply to the request waiting for it and free its slots,
+        # ignoring the late replies of a process that was replaced
+        while True:
+            (request_id, detections, timings, error) = self.replies.get()
+            with self.lock:
+                waiting = self.waiting.pop(request_id, None)
+            if waiting is None:
+                continue
+            (ring, slots, done, results, stages) = waiting
+            for slot in slots:
+                ring.release(slot)
+            results.extend(detections)
+            stages.update(timings)
+            if error is not None:
+                stages["error"] = error
+            done.set()
+
+    def detect(self, frames, timings=None):
+        """
+        Function runs the detector on frames of several cameras. The cameras of a process that failed
+        the request or died are left out, the process being restarted in the latter case
+        :param frames: Dictionary mapping the camera name to its frame
+        :param timings: Dictionary the blob and forward pass seconds of the slowest worker are stored in
+        :return: Dictionary mapping the camera name to its (N, 7) detections
+        """
+        groups = {}
+        for name in frames:
+            groups.setdefault(self.worker_for(name), []).append(name)
+        submitted = []
+        for (worker, names) in groups.items():
+            # send the frames to a live process rather than wait on a dead one
+            if not self.processes[worker].is_alive():
+                self.restart(worker, self.processes[worker])
+            (request_id, done, results, stages) = (next(self.ids), threading.Event(), [], {})
+            # the ring is written under the lock so that a restart never
+            # closes it in the middle of a write
+            with self.lock:
+                (ring, requests, process) = (self.rings[worker], self.requests[worker], self.processes[worker])
+                items = []
+                for name in names:
+                    # frames that find no free slot travel pickled with the
+                    # request rather than waiting for a slot, which could
+                    # deadlock two threads each holding part of the ring
+                    frame = frames[name]
+                    slot = ring.write(frame)
+                    items.append((slot, frame.shape) if slot is not None else (None, frame))
+                self.waiting[request_id] = (ring, [slot for (slot, _) in items if slot is not None], done, results,
+                                            stages)
+            requests.put((request_id, items))
+            submitted.append((worker, process, names, done, results, stages))
+        detections = {}
+        for (worker, process, names, done, results, stages) in submitted:
+            # a process that died never answers, so check on it while waiting
+            while not done.wait(LIVENESS_CHECK_SECONDS):
+                if not process.is_alive():
+                    self.restart(worker, process)
+                    break
+            if not done.is_set():
+                continue
+            if "error" in stages:
+                print("[ERROR] detector process {} failed on the frames of {}:\n{}".format(
+                    worker, ", ".join(names), stages["error"]))
+                continue
+            detections.update(zip(names, results))
+            if timings is not None:
+                # the workers run side by side, so the batch waits for the slowest
+                for (stage, seconds) in stages.items():
+                    timings[stage] = max(timings.get(stage, 0.0), seconds)
+        return detections
+
+    def close(self):
+        for requests in self.requests:
+            requests.put(None)
+        for process in self.processes:
+            process.join()
+        for ring in self.rings:
+            ring.close()
@@ -0,0 +1,59 @@
+# router.py
+
+"""
+This module contains the asyncio ingest service that receives the frames of every camera on a single
+ROUTER socket, replying to each camera without waiting on the others
+"""
+
+import json
+
+import zmq
+import zmq.asyncio
+
+from transport import parse_frame, acknowledgement
+
+
+class RouterHub:
+    """
+    Receives frames on a ROUTER socket. imagezmq REQ senders work unchanged, and DEALER senders may
+    keep several frames in flight. Every message is acknowledged straight away and handed to a
+    callback; all the messages waiting on the socket are read in one go so that a burst from hundreds
+    of cameras costs a single wake-up of the event loop.
+    """
+
+    def __init__(self, open_port="tcp://*:5555", hwm=2, overwritten=None):
+        self.context = zmq.asyncio.Context()
+        self.socket = self.context.socket(zmq.ROUTER)
+        self.socket.setsockopt(zmq.RCVHWM, hwm)
+        self.socket.bind(open_port)
+        # blocking twin of the socket to drain it without awaiting every message
+        self.shadow = zmq.Socket.shadow(self.socket.underlying)
+        # count of overwritten frames of a camera to acknowledge with
+        self.overwritten = overwritten
+
+    async def serve(self, handle):
+        """
+        Function receives frames forever
+        :param handle: Called with the metadata dictionary and the frame of every message
+        """
+        while True:
+            await self.socket.poll(flags=zmq.POLLIN)
+            while True:
+                try:
+                    parts = self.shadow.recv_multipart(zmq.NOBLOCK, copy=False)
+                except zmq.Again:
+                    break
+                self.receive(parts, handle)
+
+    def receive(self, parts, handle):
+        # REQ senders put an empty delimiter between their identity and the
+        # message, and expect it back in the reply
+        (identity, envelope, md, payload) = (parts[0], parts[1:-2], parts[-2], parts[-1])
+        md = json.loads(md.bytes)
+        reply = acknowledgement(None if self.overwritten is None else self.overwritten(md["msg"]))
+        self.shadow.send_multipart([identity] + [b""] * len(envelope) + [reply], zmq.NOBLOCK)
+        handle(md, parse_frame(md, payload))
+
+    def close(self):
+        self.socket.close()
+        self.context.term()
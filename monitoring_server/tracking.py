@@ -0,0 +1,135 @@
+# tracking.py
+
+"""
+This module contains the trackers that carry detections between detector runs so that the network
+only has to run every few frames per camera
+"""
+
+import threading
+
+import numpy as np
+import cv2
+
+# parameters of the corner detection and the Lucas-Kanade optical flow used
+# to follow the detected boxes
+FEATURE_PARAMS = dict(maxCorners=20, qualityLevel=0.01, minDistance=5)
+FLOW_PARAMS = dict(winSize=(15, 15), maxLevel=2,
+                   criteria=(cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 10, 0.03))
+
+
+class CameraTracker:
+    """
+    Follows the boxes of the last detection of one camera with sparse optical flow. The detections are
+    kept in the (N, 7) layout of the DetectionOutput layer, so tracked frames go through the same
+    post-processing as detected ones.
+    """
+
+    def __init__(self):
+        self.gray = None
+        self.rows = None
+        self.points = None
+        self.owners = None
+        self.since = 0
+        self.confidence = 0.0
+        self.detections = 0
+        self.tracked = 0
+
+    def due(self, interval, min_confidence):
+        """
+        Function decides whether the detector has to run on the next frame
+        :param interval: Run the detector every this many frames
+        :param min_confidence: Fraction of tracked points below which the detector runs straight away
+        :return: True if the detector has to run
+        """
+        return self.rows is None or self.since + 1 >= interval or self.confidence < min_confidence
+
+    def reset(self, frame, rows):
+        """
+        Function starts following the boxes of a fresh detection
+        :param frame: Frame the detector ran on
+        :param rows: (N, 7) detections to follow, already filtered by confidence
+        """
+        self.gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        (h, w) = self.gray.shape
+        (points, owners) = ([], [])
+        for (k, row) in enumerate(rows):
+            (startX, startY, endX, endY) = np.clip(row[3:7] * np.array([w, h, w, h]), 0, [w, h, w, h]).astype("int")
+            mask = np.zeros_like(self.gray)
+            mask[startY:endY, startX:endX] = 255
+            corners = cv2.goodFeaturesToTrack(self.gray, mask=mask, **FEATURE_PARAMS)
+            if corners is not None:
+                points.append(corners)
+                owners.extend([k] * len(corners))
+        self.points = np.concatenate(points) if points else np.empty((0, 1, 2), np.float32)
+        self.owners = np.array(owners, dtype="int")
+        self.rows = rows.copy()
+        self.since = 0
+        self.confidence = 1.0
+        self.detections += 1
+
+    def track(self, frame):
+        """
+        Function moves the boxes of the last detection along with the points found inside them
+        :param frame: New frame of the camera
+        :return: (N, 7) detections with the boxes moved to the new frame
+        """
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        self.since += 1
+        self.tracked += 1
+        if len(self.points):
+            (h, w) = gray.shape
+            (moved, status, _) = cv2.calcOpticalFlowPyrLK(self.gray, gray, self.points, None, **FLOW_PARAMS)
+            found = status.ravel() == 1
+            # every box moves by the median displacement of its surviving points
+            shift = (moved - self.points).reshape(-1, 2)
+            for k in np.unique(self.owners[found]):
+                (dx, dy) = np.median(shift[found & (self.owners == k)], axis=0)
+                self.rows[k, 3:7] += np.array([dx / w, dy / h, dx / w, dy / h])
+            # the worst tracked box decides how much the boxes can still be trusted
+            kept = np.bincount(self.owners[found], minlength=len(self.rows))
+            total = np.bincount(self.owners, minlength=len(self.rows))
+            self.confidence = float(np.min(kept[total > 0] / total[total > 0]))
+            (self.points, self.owners) = (moved[found], self.owners[found])
+        self.gray = gray
+        return self.rows.copy()
+
+    def stats(self):
+        """
+        Function reports how many frames ran the detector and how many were tracked
+        :return: Dictionary of the detector and tracker frame counts
+        """
+        return {"detections": self.detections, "tracked": self.tracked}
+
+
+class DetectionScheduler:
+    """
+    Adapts how often the detector runs to the load of the inference workers: the interval grows while
+    the workers spend nearly all their time processing and shrinks back once they are waiting for frames.
+    """
+
+    def __init__(self, interval=1, max_interval=1, high=0.9, low=0.6, smoothing=0.1):
+        self.lock = threading.Lock()
+        self.min_interval = interval
+        self.max_interval = max(interval, max_interval)
+        self.interval = interval
+        self.high = high
+        self.low = low
+        self.smoothing = smoothing
+        self.busy = 0.0
+
+    def record(self, waiting, working):
+        """
+        Function records one loop of a worker and adjusts the detection interval
+        :param waiting: Seconds the worker waited for frames
+        :param working: Seconds the worker spent processing them
+        :return: Detection interval to use
+        """
+        with self.lock:
+            total = waiting + working
+            if total > 0:
+                self.busy += self.smoothing * (working / total - self.busy)
+            if self.busy > self.high and self.interval < self.max_interval:
+                self.interval += 1
+            elif self.busy < self.low and self.interval > self.min_interval:
+                self.interval -= 1
+            return self.interval
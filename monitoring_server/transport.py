@@ -0,0 +1,134 @@
+# transport.py
+
+"""
+This module contains the helpers that receive frames sent either as raw arrays or as JPEG buffers
+"""
+
+import time
+
+import numpy as np
+import imagezmq
+import zmq
+import cv2
+from imagezmq.imagezmq import SerializingContext
+
+
+class JpegFrame:
+    """
+    JPEG buffer received from a camera. The buffer is only decoded when the frame is actually used,
+    so frames overwritten in their slot before a worker takes them never cost a decode.
+    """
+
+    def __init__(self, buffer):
+        self.buffer = buffer
+        self.image = None
+
+    def __len__(self):
+        return len(self.buffer)
+
+    def decode(self):
+        """
+        Function decodes the JPEG buffer into a BGR frame, once
+        :return: BGR frame, None if the buffer is not a valid image
+        """
+        if self.image is None:
+            self.image = cv2.imdecode(np.frombuffer(self.buffer, dtype=np.uint8), cv2.IMREAD_COLOR)
+        return self.image
+
+
+class PullHub:
+    """
+    Receives frames on a PULL socket. Cameras push frames without waiting for a reply, and the high-water
+    mark keeps only a couple of frames queued per camera so stale frames are dropped at the socket.
+    Mirrors the imagezmq.ImageHub interface so that it can be used in its place.
+    """
+
+    def __init__(self, open_port='tcp://*:5555', hwm=2):
+        self.zmq_context = SerializingContext()
+        self.zmq_socket = self.zmq_context.socket(zmq.PULL)
+        self.zmq_socket.setsockopt(zmq.RCVHWM, hwm)
+        self.zmq_socket.bind(open_port)
+
+    def recv_image(self, copy=False):
+        return self.zmq_socket.recv_array(copy=copy)
+
+    def recv_jpg(self, copy=False):
+        return self.zmq_socket.recv_jpg(copy=copy)
+
+    def send_reply(self, reply_message=b'OK'):
+        # nothing to acknowledge, PUSH senders do not wait for a reply
+        pass
+
+    def close(self):
+        self.zmq_socket.close()
+        self.zmq_context.term()
+
+
+def acknowledgement(overwritten=None):
+    """
+    Function builds the reply acknowledging a frame: the time of the server, which cameras compare with
+    their own clock around the round trip to estimate the offset between the two, followed by the
+    number of frames of the camera overwritten in their slot before a worker took them. The reply is
+    sent before inference, so only that count tells a camera it sends faster than its frames are
+    processed
+    :param overwritten: Number of overwritten frames of the camera, None to send the time only
+    :return: Bytes of the reply
+    """
+    reply = "{:.6f}".format(time.time())
+    if overwritten is not None:
+        reply += " {}".format(overwritten)
+    return reply.encode()
+
+
+def open_hub(transport, port=5555, hwm=2, overwritten=None):
+    """
+    Function opens the socket the cameras send their frames to
+    :param transport: Either 'reqrep' for the blocking imagezmq REQ/REP pattern, 'pushpull' or 'router'
+    :param port: TCP port to listen on
+    :param hwm: High-water mark of the PULL or ROUTER socket, ignored for REQ/REP
+    :param overwritten: Called with the name of a camera to get the count of overwritten frames the ROUTER
+        socket acknowledges its frames with, ignored for REQ/REP and PUSH/PULL
+    :return: imagezmq.ImageHub, PullHub or router.RouterHub
+    """
+    address = "tcp://*:{}".format(port)
+    if transport == "pushpull":
+        return PullHub(open_port=address, hwm=hwm)
+    if transport == "router":
+        # imported here as the router pulls in asyncio support
+        from router import RouterHub
+        return RouterHub(open_port=address, hwm=hwm, overwritten=overwritten)
+    return imagezmq.ImageHub(open_port=address)
+
+
+def recv_frame(socket):
+    """
+    Function receives a frame sent with either ImageSender.send_image or ImageSender.send_jpg
+    :param socket: imagezmq SerializingSocket of the ImageHub
+    :return: Tuple of the metadata dictionary sent with the frame and the frame, a JpegFrame for JPEG buffers
+    """
+    md = socket.recv_json()
+    return md, parse_frame(md, socket.recv(copy=False))
+
+
+def parse_frame(md, buffer):
+    """
+    Function turns the payload of a frame message into a frame
+    :param md: Metadata dictionary sent with the frame
+    :param buffer: zmq.Frame holding the payload
+    :return: Array for raw frames, JpegFrame for JPEG buffers
+    """
+    # send_image describes the array it sends, send_jpg only sends the message
+    if "dtype" in md:
+        return np.frombuffer(buffer, dtype=md["dtype"]).reshape(md["shape"])
+    return JpegFrame(buffer.buffer)
+
+
+def decode(frame):
+    """
+    Function returns the BGR image of a received frame
+    :param frame: Raw array or JpegFrame returned by recv_frame
+    :return: BGR frame
+    """
+    if isinstance(frame, JpegFrame):
+        return frame.decode()
+    return frame